@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+"""cache.py
+
+Read-through memcache helpers for conference data.
+
+Cached values are stored under keys that embed a per-conference generation
+number.  Writers bump the generation after they commit, which orphans every
+entry built from older data instead of having to find and delete them.
+
+Values read through readWithLease are refilled by one request at a time,
+guarded by a lease added to memcache next to the value.
+
+Caches named in keepLocal() are also kept for a few seconds in a per-instance
+LRU in front of memcache, together with the generations of their scopes.
+Writes made on this instance drop the local copies at once; writes on other
+instances show up here within LOCAL_TIME seconds.
+
+"""
+
+import threading
+
+from collections import OrderedDict
+from time import sleep
+from time import time as unixtime
+
+from google.appengine.api import memcache
+
+GENERATION_PREFIX = "gen-"
+STATS_PREFIX = "cachestats-"
+LEASE_SUFFIX = "-lease"
+STALE_SUFFIX = "-stale"
+
+# seconds a cached value lives even if its generation is never bumped
+CACHE_TIME = 600
+# seconds between flushes of this instance's hit/miss counts to memcache
+STATS_FLUSH_INTERVAL = 10
+# seconds a request may hold the lease to refill a missing value
+LEASE_TIME = 10
+# seconds, and seconds between polls, that a request without the lease
+# and without a stale value waits for the lease holder's value
+LEASE_WAIT = 1.0
+LEASE_POLL = 0.05
+# seconds a value stays in this instance's local tier, and its entry limit
+LOCAL_TIME = 5
+LOCAL_SIZE = 1000
+
+_stats = {}
+_stats_lock = threading.Lock()
+_last_flush = [unixtime()]
+_local_names = set()
+
+
+class LocalCache(object):
+    """Thread-safe in-process LRU cache whose entries expire after ttl
+    seconds; counts hits, misses and entries evicted for space."""
+
+    def __init__(self, size=LOCAL_SIZE, ttl=LOCAL_TIME):
+        self.size = size
+        self.ttl = ttl
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the live value cached under key, or None."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[1] < unixtime():
+                self.misses += 1
+                return None
+            # re-insert as the most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        """Cache value under key, evicting the least recently used entries
+        beyond size; returns how many were evicted."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, unixtime() + self.ttl)
+            evicted = 0
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+            return evicted
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+_local = LocalCache()
+
+
+def keepLocal(*names):
+    """Keep the values of the named caches in the local tier too."""
+    _local_names.update(names)
+
+
+def _getLocal(name, key):
+    """Return the local copy of key for cache name, counting the access."""
+    if name not in _local_names:
+        return None
+    value = _local.get(key)
+    countAccess(name, 'localHits' if value is not None else 'localMisses')
+    return value
+
+
+def _setLocal(name, key, value):
+    if name in _local_names:
+        _storeLocal(key, value)
+
+
+def _storeLocal(key, value):
+    if _local.set(key, value):
+        countAccess('local', 'evictions')
+
+
+def getGeneration(scope, local=False):
+    """Return the current generation number for scope (a websafe key),
+    from the local tier if local."""
+    gen_key = GENERATION_PREFIX + scope
+    gen = _local.get(gen_key) if local else None
+    if gen is not None:
+        return gen
+    gen = memcache.get(gen_key)
+    if gen is None:
+        # start from the clock so a re-created generation is always newer
+        # than any evicted one that cached values might still refer to
+        memcache.add(gen_key, int(unixtime() * 1000))
+        gen = memcache.get(gen_key)
+    if local and gen is not None:
+        _storeLocal(gen_key, gen)
+    return gen
+
+
+def bumpGeneration(scope):
+    """Invalidate everything cached for scope; call after the write commits."""
+    memcache.incr(GENERATION_PREFIX + scope)
+    _local.delete(GENERATION_PREFIX + scope)
+
+
+def versionedKey(name, scope, *parts):
+    """Return the memcache key for cache name, scope and extra key parts
+    at the scope's current generation."""
+    gen = getGeneration(scope, local=name in _local_names)
+    return '-'.join([name, scope, str(gen)] + list(parts))
+
+
+def readThrough(name, key, fill, time=CACHE_TIME):
+    """Return the value cached under key, calling fill() and caching its
+    result on a miss.  fill() must not return None."""
+    value = _getLocal(name, key)
+    if value is not None:
+        return value
+    value = memcache.get(key)
+    if value is not None:
+        countAccess(name, 'hits')
+    else:
+        countAccess(name, 'misses')
+        value = fill()
+        memcache.set(key, value, time=time)
+    _setLocal(name, key, value)
+    return value
+
+
+def readWithLease(name, key, fill, time=CACHE_TIME):
+    """Return the value cached under key.  On a miss only the request that
+    adds the key's lease calls fill() and caches its result; the others
+    return the previous value or wait up to LEASE_WAIT seconds for the new
+    one, so an eviction doesn't send every request to the datastore at
+    once.  fill() must not return None."""
+    value = _getLocal(name, key)
+    if value is not None:
+        return value
+    cached = memcache.get_multi([key, key + STALE_SUFFIX])
+    if key in cached:
+        countAccess(name, 'hits')
+        _setLocal(name, key, cached[key])
+        return cached[key]
+    countAccess(name, 'misses')
+    lease_key = key + LEASE_SUFFIX
+    client = memcache.Client()
+    if client.add(lease_key, 0, time=LEASE_TIME):
+        client.gets(lease_key)
+        value = fill()
+        # invalidate() drops the lease, so don't cache what fill() read if
+        # the value was invalidated meanwhile
+        if client.cas(lease_key, 1, time=LEASE_TIME):
+            setWithStale(key, value, time)
+            client.delete(lease_key)
+            _setLocal(name, key, value)
+        return value
+    if key + STALE_SUFFIX in cached:
+        return cached[key + STALE_SUFFIX]
+    deadline = unixtime() + LEASE_WAIT
+    while unixtime() < deadline:
+        sleep(LEASE_POLL)
+        value = memcache.get(key)
+        if value is not None:
+            return value
+    # the lease holder is slow or failed; compute without caching
+    return fill()
+
+
+def setWithStale(key, value, time=CACHE_TIME):
+    """Cache value under key, and keep it as the stale copy served while
+    a later miss is being refilled."""
+    memcache.set(key + STALE_SUFFIX, value)
+    memcache.set(key, value, time=time)
+    _local.delete(key)
+
+
+def invalidate(key):
+    """Drop the value cached under key, and any refill in progress."""
+    memcache.delete_multi([key, key + LEASE_SUFFIX])
+    _local.delete(key)
+
+
+def countAccess(name, outcome):
+    """Count a cache hit or miss; counts are batched per instance and
+    periodically added to the shared totals in memcache."""
+    with _stats_lock:
+        stat = '%s-%s' % (name, outcome)
+        _stats[stat] = _stats.get(stat, 0) + 1
+        if unixtime() - _last_flush[0] < STATS_FLUSH_INTERVAL:
+            return
+        pending = dict(_stats)
+        _stats.clear()
+        _last_flush[0] = unixtime()
+    memcache.offset_multi(pending, key_prefix=STATS_PREFIX, initial_value=0)
+
+
+def getStats(names):
+    """Return [(name, hits, misses, localHits, localMisses)] totals for the
+    given cache names; hits and misses are those of memcache."""
+    outcomes = ('hits', 'misses', 'localHits', 'localMisses')
+    stats = memcache.get_multi(
+        ['%s-%s' % (name, outcome) for name in names for outcome in outcomes],
+        key_prefix=STATS_PREFIX)
+    return [tuple([name] + [stats.get('%s-%s' % (name, outcome), 0)
+                            for outcome in outcomes])
+            for name in names]
+
+
+def getLocalEvictions():
+    """Return how many local tier entries all instances evicted for space."""
+    return memcache.get('local-evictions', key_prefix=STATS_PREFIX) or 0
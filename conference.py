@@ -23,8 +23,11 @@ import endpoints
 from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
+from protorpc import protojson
 
+from google.appengine.ext import blobstore
 from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
 
 from models import Profile
 from models import ProfileMiniForm
@@ -33,31 +36,68 @@ from models import TeeShirtSize
 
 from settings import WEB_CLIENT_ID
 from utils import getUserId
+import cache
+import instrument
+import mapper
+import search
 from models import Conference
+from models import ConferenceImport
+from models import SeatShard
 from models import ConferenceForm
 from models import ConferenceForms
 from models import QueryForm
 from models import QueryForms
 
 from models import Session
+from models import ConferenceSchedule
+from models import NearlySoldOut
 from models import SessionForm
 from models import SessionForms
+from models import SessionResultForm
+from models import SessionResultForms
+from models import AgendaItemForm
+from models import AgendaForms
+from models import BookingConflictForm
+from models import BookingConflictForms
+from models import SessionRegistration
+from models import WishlistEntry
 from models import SessionType
 
 from models import Speaker
 from models import SpeakerForm
 from models import SpeakerMiniForm
 from models import SpeakerList
+from models import SpeakerDirectory
+from models import SpeakerDirectoryChunk
+from models import FacetCounts
+from models import CountedFacets
+from models import FacetCountForm
+from models import FacetCountForms
 
 from models import BooleanMessage
+from models import ConferenceKeysForm
+from models import RegistrationResultForm
+from models import RegistrationResultForms
 from models import ConflictException
 
 from google.appengine.api import memcache
 from models import StringMessage
+from google.appengine.api import datastore_index
 from google.appengine.api import taskqueue
+from google.appengine.runtime import apiproxy_errors
 from collections import namedtuple
-
+from time import time as unixtime
+
+import bisect
+import csv
+import hashlib
+import heapq
+import itertools
+import json
 import logging
+import os
+import random
+import zlib
 
        
 
@@ -82,6 +122,30 @@ SESSION_CREATE = endpoints.ResourceContainer(
     websafeKey=messages.StringField(1),
 )
 
+SESSIONS_CREATE = endpoints.ResourceContainer(
+    SessionForms,
+    websafeKey=messages.StringField(1),
+)
+
+SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+)
+
+FACETS_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    facet=messages.StringField(1),
+    value=messages.StringField(2),
+)
+
+SPEAKERS_PAGE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1),
+    pageToken=messages.StringField(2),
+)
+
 DEFAULTS = {
     "city": "Default City",
     "maxAttendees": 0,
@@ -94,6 +158,17 @@ SESSIONDEFAULTS = {
     "seatsAvailable": 0,
 }
 
+SESSIONREQUIRED = ('name', 'speaker', 'date', 'time', 'duration', 'location')
+
+# limits for storing sessions in bulk: sessions per put and speakers per
+# transaction (the conference's entity group takes one more of the 25)
+MAX_BATCH_SESSIONS = 400
+MAX_TXN_SPEAKERS = 24
+# most sessions per createSessions request, and session names listed in
+# its confirmation email
+MAX_CREATE_SESSIONS = 1000
+MAX_EMAIL_SESSIONS = 50
+
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 
@@ -115,13 +190,108 @@ CONFERENCEFIELDS =    {
 
 SESSIONFIELDS =     {
             'DATE': 'date',
-            'TIME': 'time',
+            'TIME': 'startMinute',
+            'END_TIME': 'endMinute',
             'DURATION': 'duration',
             'LOCATION': 'location',
             'SEATSAVAILABLE': 'seatsAvailable',
+            'TYPE': 'sessionType',
+}
+
+# session fields holding a time of day as minutes since midnight
+MINUTEFIELDS = ('startMinute', 'endMinute')
+
+# comparisons for filters, applied to model properties to build datastore
+# filters or to values when filtering in memory
+COMPARATORS = {
+            '=':    lambda a, b: a == b,
+            '>':    lambda a, b: a > b,
+            '>=':   lambda a, b: a >= b,
+            '<':    lambda a, b: a < b,
+            '<=':   lambda a, b: a <= b,
+            '!=':   lambda a, b: a != b,
 }
 
 MEMCACHE_ANNOUNCEMENTS_KEY = "CONFERENCE_ANNOUNCEMENTS"
+MEMCACHE_FEATURED_SPEAKER_PREFIX = "featuredspeaker-"
+SPEAKER_DIRECTORY_SCOPE = "speakers"
+SPEAKER_DIRECTORY_ID = "index"
+NEARLY_SOLD_OUT_ID = "nearlySoldOut"
+MEMCACHE_SEATS_PREFIX = "seats-"
+MEMCACHE_ORGANIZER_PREFIX = "organizer-"
+MEMCACHE_SEARCH_PREFIX = "search-"
+
+# seats are split over at most this many SeatShard entities per conference;
+# must stay below the cross-group transaction limit used when initializing
+SEAT_SHARDS = 20
+# seat shards a batch registration transaction touches besides the Profile
+MAX_TXN_SHARDS = 24
+# seconds a summed seat count may be served from memcache
+SEATS_CACHE_TIME = 60
+# seconds between syncs of the shards onto Conference.seatsAvailable
+SEATS_SYNC_DELAY = 10
+# a conference is nearly sold out at or below this many seats
+NEARLY_SOLD_OUT_SEATS = 5
+
+# read-through caches of conference data, see cache.py
+CACHE_NAMES = ('conference', 'sessions', 'sessionsByType', 'speakers',
+               'announcement', 'featuredSpeaker', 'search')
+# hot, rarely changing caches also kept in each instance's memory
+cache.keepLocal('conference', 'speakers', 'announcement')
+
+# a planned query: the datastore query and the filters left to apply in memory
+QueryPlan = namedtuple('QueryPlan', ['query', 'residual'])
+# file declaring the app's composite indexes, which the query planner reads
+INDEX_FILE = os.path.join(os.path.dirname(__file__), 'index.yaml')
+
+
+def _loadCompositeIndexes(path):
+    """Return {kind: [property names]} of the non-ancestor, all ascending
+    composite indexes declared in the index.yaml at path."""
+    with open(path) as f:
+        definitions = datastore_index.ParseIndexDefinitions(f)
+    indexes = {}
+    for index in (definitions.indexes if definitions else None) or []:
+        if index.ancestor or any(prop.direction not in (None, 'asc')
+                                 for prop in index.properties or []):
+            continue
+        indexes.setdefault(index.kind, []).append(
+            tuple(prop.name for prop in index.properties))
+    return indexes
+
+# the indexes the query planner may rely on, as deployed with the app
+COMPOSITE_INDEXES = _loadCompositeIndexes(INDEX_FILE)
+
+# most entities a planned query examines per request, and its batch size
+MAX_SCAN = 1000
+SCAN_BATCH_SIZE = 200
+
+# seconds a ranked search result list is reused for further pages
+SEARCH_CACHE_TIME = 60
+
+# longest description snippet kept in a schedule entry
+SCHEDULE_DESCRIPTION_LENGTH = 200
+
+# most speakers per SpeakerDirectoryChunk; fuller chunks are split in two
+SPEAKER_CHUNK_SIZE = 1000
+
+# lines read per task, and error messages kept, by conference imports
+IMPORT_BATCH_SIZE = 200
+MAX_IMPORT_ERRORS = 100
+
+# upper bounds of the seatsAvailable facet buckets, and the last bucket
+SEAT_BUCKETS = ((0, '0'), (NEARLY_SOLD_OUT_SEATS, '1-%d' % NEARLY_SOLD_OUT_SEATS),
+                (20, '%d-20' % (NEARLY_SOLD_OUT_SEATS + 1)), (100, '21-100'))
+SEAT_BUCKET_MAX = '101+'
+FACETS = ('city', 'month', 'topics', 'seats')
+FACET_SCOPE_ALL = 'all'
+# FacetCounts shards per scope, and conferences counted per task
+FACET_SHARDS = 10
+FACET_TASK_SIZE = 25
+
+# page sizes for the query endpoints
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
 
 
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -135,50 +305,145 @@ class ConferenceApi(remote.Service):
     """Conference API v0.1"""
     
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def _isNearlySoldOut(seats):
+        """Return whether a conference with seats left belongs in the
+        announcement."""
+        return seats is not None and 0 < seats <= NEARLY_SOLD_OUT_SEATS
+
+    @staticmethod
+    def _seedNearlySoldOut():
+        """Merge one query over Conference.seatsAvailable into the durable
+        nearly sold out list; only needed once, after which
+        _setNearlySoldOut keeps it current."""
+        # Conference.seatsAvailable only trails the seat shards by a few
+        # seconds, so use it to find candidates and the shards to confirm
+        candidates = Conference.query(ndb.AND(
+            Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS,
+            Conference.seatsAvailable > 0)
+        ).fetch()
+        seats = ConferenceApi._getSeatsAvailableMulti(candidates)
+
+        # conferences that crossed the threshold since the query started
+        # were recorded by _setNearlySoldOut, and that record wins
+        @ndb.transactional
+        def _merge():
+            soldout = ndb.Key(NearlySoldOut, NEARLY_SOLD_OUT_ID).get()
+            if soldout and soldout.seeded:
+                return soldout
+            soldout = soldout or NearlySoldOut(id=NEARLY_SOLD_OUT_ID)
+            soldout.conferences.extend(
+                conf.key for conf in candidates
+                if conf.key not in soldout.touched and
+                conf.key not in soldout.conferences and
+                ConferenceApi._isNearlySoldOut(seats[conf.key.urlsafe()]))
+            soldout.seeded = True
+            soldout.touched = []
+            soldout.put()
+            return soldout
+        return _merge()
+
+    @staticmethod
+    def _setNearlySoldOut(c_keys, nearly):
+        """Add (or remove, if not nearly) conferences to the nearly sold
+        out list; call within a transaction.  Returns whether it changed.
+        Before the list is seeded, the change is recorded all the same, so a
+        conference crossing while the seed query runs isn't lost."""
+        soldout = ndb.Key(NearlySoldOut, NEARLY_SOLD_OUT_ID).get()
+        if not soldout:
+            soldout = NearlySoldOut(id=NEARLY_SOLD_OUT_ID, seeded=False)
+        touched = [] if soldout.seeded else \
+            [c_key for c_key in c_keys if c_key not in soldout.touched]
+        soldout.touched.extend(touched)
+        if nearly:
+            added = [c_key for c_key in c_keys if c_key not in soldout.conferences]
+            soldout.conferences.extend(added)
+        else:
+            added = [c_key for c_key in c_keys if c_key in soldout.conferences]
+            soldout.conferences = [c_key for c_key in soldout.conferences
+                                   if c_key not in added]
+        if added or touched:
+            soldout.put()
+        return bool(added)
+
     @staticmethod
     def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+        """Create Announcement & assign to memcache; used by the
+        set_announcement handler.
         """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
+        announcement = ConferenceApi._announcementText()
+        # expire so that renamed conferences show up eventually
+        cache.setWithStale(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+        return announcement
+
+    @staticmethod
+    def _announcementText():
+        """Return the Announcement built from the nearly sold out list."""
+        soldout = ndb.Key(NearlySoldOut, NEARLY_SOLD_OUT_ID).get()
+        if not soldout or not soldout.seeded:
+            soldout = ConferenceApi._seedNearlySoldOut()
+        confs = [conf for conf in ndb.get_multi(soldout.conferences) if conf]
 
         if confs:
             # If there are almost sold out conferences,
-            # format announcement and set it in memcache
+            # format announcement
             announcement = '%s %s' % (
                 'Last chance to attend! The following conferences '
                 'are nearly sold out:',
                 ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
         else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
+            # If there are no sold out conferences, the empty
+            # announcement is cached too so that misses stay rare
             announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
 
         return announcement
     
     @staticmethod
     def _cacheFeaturedSpeaker(c_urlsafeKey,speaker_id):
         """ Cache a featured speaker and associated sessions for a conference
-            Called from getFeaturedSpeaker and CreateFeaturedSpeaker(from the task queue)
+            Called from CreateFeaturedSpeaker(from the task queue)
+        """
+        memstring = ConferenceApi._featuredSpeakerText(c_urlsafeKey, speaker_id)
+        cache.setWithStale(MEMCACHE_FEATURED_SPEAKER_PREFIX + c_urlsafeKey,
+                           memstring, time=0)
+        return(memstring)
+
+    @staticmethod
+    def _findFeaturedSpeaker(c_urlsafeKey):
+        """ Rebuild the featured speaker text of a conference after it was
+            evicted: the speaker of the latest session among those
+            presenting 2 or more, as the task would have chosen
         """
+        latest = {}
+        counts = {}
+        for entry in ConferenceApi._getSchedule(ndb.Key(urlsafe=c_urlsafeKey)):
+            speaker_id = entry['speaker']
+            # session ids are allocated in increasing order
+            s_id = ndb.Key(urlsafe=entry['websafeKey']).id()
+            counts[speaker_id] = counts.get(speaker_id, 0) + 1
+            latest[speaker_id] = max(latest.get(speaker_id, s_id), s_id)
+        repeat = [speaker_id for speaker_id in counts
+                  if speaker_id and counts[speaker_id] >= 2]
+        if not repeat:
+            return ""
+        return ConferenceApi._featuredSpeakerText(c_urlsafeKey,
+            max(repeat, key=lambda speaker_id: latest[speaker_id]))
+
+    @staticmethod
+    def _featuredSpeakerText(c_urlsafeKey, speaker_id):
+        """ Return the featured speaker text for a speaker at a conference """
         logging.info("speaker id=%s"%speaker_id)
         c_key = ndb.Key(urlsafe=c_urlsafeKey)
-        sessionlist = Session.query(ancestor=c_key).fetch()
+        # only this speaker's session names at this conference are read,
+        # alongside the speaker entity
+        sessions_future = Session.query(Session.speaker == speaker_id,
+            ancestor=c_key).fetch_async(projection=[Session.name])
+        speaker_future = ndb.Key(Speaker,speaker_id).get_async()
         memstring=""
-        featuredsessions=[]
-        for session in sessionlist:
-            if session.speaker == speaker_id:
-                    featuredsessions.append(session.name)
+        featuredsessions=[session.name for session in sessions_future.get_result()]
         memstring = 'Featured speaker,%s, will be leading the following sessions %s' % (
-            ndb.Key(Speaker,speaker_id).get().displayName,
+            speaker_future.get_result().displayName,
             ', '.join(featuredsessions))
-        if memstring:
-            memcache.set("featuredspeaker-%s"%c_urlsafeKey,memstring)
         return(memstring)
            
 
@@ -189,60 +454,321 @@ class ConferenceApi(remote.Service):
         """Return Announcement from memcache."""
         # TODO 1
         # return an existing announcement from Memcache or an empty string.
-        announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
-        if announcement is not None:
-            return StringMessage(data=announcement)
+        announcement = cache.readWithLease('announcement',
+            MEMCACHE_ANNOUNCEMENTS_KEY, self._announcementText)
+        return StringMessage(data=announcement)
+
+# - - - Seat counters - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def _makeSeatShards(key, seats):
+        """Return new SeatShard entities splitting seats for a conference
+        or session."""
+        count = max(1, min(SEAT_SHARDS, seats))
+        wsck = key.urlsafe()
+        if key.kind() == 'Session':
+            owners = {'conference': key.parent(), 'session': key}
         else:
-            return StringMessage(data=self._cacheAnnouncement())
+            owners = {'conference': key}
+        return [SeatShard(id='%s:%d' % (wsck, i),
+                          seats=seats // count + (1 if i < seats % count else 0),
+                          **owners)
+                for i in range(count)]
+
+    @staticmethod
+    def _seatShardKeys(conf):
+        """Return the SeatShard keys of a sharded conference or session."""
+        wsck = conf.key.urlsafe()
+        return [ndb.Key(SeatShard, '%s:%d' % (wsck, i))
+                for i in range(conf.seatShards)]
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _initSeatShards(key):
+        """Split seatsAvailable of a session, or of a conference created
+        before seat shards existed; returns the now sharded entity."""
+        conf = key.get()
+        if not conf.seatShards:
+            shards = ConferenceApi._makeSeatShards(key, conf.seatsAvailable or 0)
+            conf.seatShards = len(shards)
+            ndb.put_multi(shards + [conf])
+        return conf
+
+    @staticmethod
+    @ndb.tasklet
+    def _getSeatsAvailableMultiAsync(confs):
+        """Tasklet returning {websafeKey: seats available} for the given
+        conferences, summing seat shards not already counted in memcache."""
+        seats = {}
+        sharded = []
+        for conf in confs:
+            if conf.seatShards:
+                sharded.append(conf)
+            else:
+                seats[conf.key.urlsafe()] = conf.seatsAvailable
+        if not sharded:
+            raise ndb.Return(seats)
+
+        cached = yield memcache.Client().get_multi_async(
+            [conf.key.urlsafe() for conf in sharded],
+            key_prefix=MEMCACHE_SEATS_PREFIX)
+        seats.update(cached)
+        missing = [conf for conf in sharded if conf.key.urlsafe() not in seats]
+        shard_keys = [key for conf in missing for key in ConferenceApi._seatShardKeys(conf)]
+        shards = dict(zip(shard_keys, (yield ndb.get_multi_async(shard_keys))))
+        counted = {}
+        for conf in missing:
+            counted[conf.key.urlsafe()] = sum(shards[key].seats
+                for key in ConferenceApi._seatShardKeys(conf) if shards[key])
+        if counted:
+            yield memcache.Client().add_multi_async(counted, time=SEATS_CACHE_TIME,
+                                                    key_prefix=MEMCACHE_SEATS_PREFIX)
+            seats.update(counted)
+        raise ndb.Return(seats)
+
+    @staticmethod
+    def _getSeatsAvailableMulti(confs):
+        """Return {websafeKey: seats available} for the given conferences."""
+        return ConferenceApi._getSeatsAvailableMultiAsync(confs).get_result()
+
+    @staticmethod
+    def _getSeatsAvailable(conf):
+        """Return seats available for a single conference."""
+        return ConferenceApi._getSeatsAvailableMulti([conf])[conf.key.urlsafe()]
+
+    @staticmethod
+    def _syncSeatsAvailable(urlsafeKey):
+        """Copy the summed seat shards onto seatsAvailable of a Conference,
+        or of a Session and its schedule entry, so that queries filtering
+        on it stay close to the real count; called from the task queue.
+        """
+        key = ndb.Key(urlsafe=urlsafeKey)
+        conf = key.get()
+        if not conf or not conf.seatShards:
+            return
+        total = sum(shard.seats for shard in
+            ndb.get_multi(ConferenceApi._seatShardKeys(conf)) if shard)
+        memcache.set(MEMCACHE_SEATS_PREFIX + urlsafeKey, total,
+                     time=SEATS_CACHE_TIME)
+
+        # a session and its conference's schedule share an entity group;
+        # a conference crossing the nearly sold out threshold updates the
+        # announcement's list in the same transaction
+        soldout = []
+
+        @ndb.transactional(xg=True)
+        def _update():
+            del soldout[:]
+            conf = key.get()
+            if conf.seatsAvailable == total:
+                return False
+            nearly = ConferenceApi._isNearlySoldOut(total)
+            if key.kind() == 'Conference' and \
+                    nearly != ConferenceApi._isNearlySoldOut(conf.seatsAvailable):
+                soldout.append(ConferenceApi._setNearlySoldOut([key], nearly))
+            conf.seatsAvailable = total
+            changed = [conf]
+            if key.kind() == 'Session':
+                schedule = ConferenceApi._loadSchedule(key.parent())
+                for entry in schedule.sessions:
+                    if entry['websafeKey'] == urlsafeKey:
+                        entry['seatsAvailable'] = total
+                changed.append(schedule)
+            ndb.put_multi(changed)
+            return True
+        updated = _update()
+        if updated and key.kind() == 'Session':
+            cache.bumpGeneration(key.parent().urlsafe())
+        if any(soldout):
+            cache.invalidate(MEMCACHE_ANNOUNCEMENTS_KEY)
+        if updated and key.kind() == 'Conference':
+            # may move the conference to another seats bucket
+            ConferenceApi._countFacets([key])
+
+    @staticmethod
+    def _queueSeatSync(key):
+        """Queue at most one seatsAvailable sync per conference or session
+        every SEATS_SYNC_DELAY seconds."""
+        wsck = key.urlsafe()
+        try:
+            taskqueue.add(params={'websafeKey': wsck},
+                url='/tasks/sync_seats',
+                name='sync-seats-%s-%d' % (wsck, int(unixtime()) // SEATS_SYNC_DELAY),
+                countdown=SEATS_SYNC_DELAY)
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
     @ndb.transactional(xg=True)
-    def _conferenceRegistration(self, request, reg=True):
-        """Register or unregister user for selected conference."""
-        retval = None
+    def _registerOnShard(self, wsck, s_key, reg):
+        """Move one seat between a seat shard and the user's Profile.
+        Returns None if the shard ran out of seats meanwhile."""
         prof = self._getProfileFromUser() # get user Profile
-
-        # check if conf exists given websafeConfKey
-        # get conference; check that it exists
-        wsck = request.websafeKey
-        conf = ndb.Key(urlsafe=wsck).get()
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % wsck)
+        shard = s_key.get()
+        c_key = ndb.Key(urlsafe=wsck)
 
         # register
         if reg:
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if c_key in prof.conferenceKeysToAttend:
                 raise ConflictException(
                     "You have already registered for this conference")
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
-                raise ConflictException(
-                    "There are no seats available.")
+            # another registration may have taken the last seat of this shard
+            if shard.seats <= 0:
+                return None
 
             # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
+            prof.conferenceKeysToAttend.append(c_key)
+            shard.seats -= 1
 
         # unregister
         else:
             # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            if c_key not in prof.conferenceKeysToAttend:
+                return False
 
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
+            # unregister user, add back one seat
+            prof.conferenceKeysToAttend.remove(c_key)
+            shard.seats += 1
 
         # write things back to the datastore & return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
+        ndb.put_multi([prof, shard])
+        return True
+
+    def _conferenceRegistration(self, request, reg=True):
+        """Register or unregister user for selected conference."""
+        return BooleanMessage(data=self._changeRegistration(request.websafeKey, reg))
+
+    def _changeRegistration(self, wsck, reg=True):
+        """Register or unregister user for the conference with websafe
+        key wsck; returns whether anything changed."""
+        # check if conf exists given websafeConfKey
+        # get conference; check that it exists
+        conf = ndb.Key(urlsafe=wsck).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        if not conf.seatShards:
+            conf = self._initSeatShards(conf.key)
+        shard_keys = self._seatShardKeys(conf)
+
+        if reg:
+            # only try shards that still had seats a moment ago;
+            # each attempt locks just the Profile and one shard
+            candidates = [shard.key for shard in ndb.get_multi(shard_keys)
+                          if shard and shard.seats > 0]
+            random.shuffle(candidates)
+            retval = None
+            for s_key in candidates:
+                retval = self._registerOnShard(wsck, s_key, reg)
+                if retval is not None:
+                    break
+            if retval is None:
+                raise ConflictException(
+                    "There are no seats available.")
+        else:
+            retval = self._registerOnShard(wsck, random.choice(shard_keys), reg)
+
+        if retval:
+            self._seatsTaken(conf.key, 1 if reg else -1)
+        return retval
+
+    def _seatsTaken(self, key, taken):
+        """Keep the cached seat total, seatsAvailable and cached conference
+        data following along after seats were taken (or given back, if
+        negative) from the shards of a conference or session."""
+        wsck = key.urlsafe()
+        if taken > 0:
+            seats = memcache.decr(MEMCACHE_SEATS_PREFIX + wsck, taken)
+        else:
+            seats = memcache.incr(MEMCACHE_SEATS_PREFIX + wsck, -taken)
+        if key.kind() == 'Conference' and seats is not None and \
+                self._isNearlySoldOut(seats) != self._isNearlySoldOut(seats + taken):
+            # the announcement changes now rather than on the next sync
+            self._syncSeatsAvailable(wsck)
+        else:
+            self._queueSeatSync(key)
+        # conference forms read seats from the shards; session listings
+        # are refreshed once the sync task updates the schedule
+        if key.kind() == 'Conference':
+            cache.bumpGeneration(wsck)
+
+    @ndb.transactional(xg=True)
+    def _registerOnShards(self, picks):
+        """Register the user for several conferences in one transaction,
+        taking a seat from the chosen shard of each; picks is a list of
+        (websafeKey, shard key).  Returns {websafeKey: outcome}, where
+        outcome is True, None if the shard ran out of seats meanwhile, or
+        an error message."""
+        prof = self._getProfileFromUser() # get user Profile
+        shards = ndb.get_multi([s_key for wsck, s_key in picks])
+        outcome = {}
+        changed = []
+        for (wsck, s_key), shard in zip(picks, shards):
+            if shard.conference in prof.conferenceKeysToAttend:
+                outcome[wsck] = "You have already registered for this conference"
+            elif shard.seats <= 0:
+                outcome[wsck] = None
+            else:
+                prof.conferenceKeysToAttend.append(shard.conference)
+                shard.seats -= 1
+                changed.append(shard)
+                outcome[wsck] = True
+        if changed:
+            ndb.put_multi([prof] + changed)
+        return outcome
+
+    def _conferencesRegistration(self, wscks):
+        """Register user for several conferences, returning a
+        RegistrationResultForm per conference."""
+        results = {}
+        c_keys = {}
+        for wsck in wscks:
+            try:
+                c_keys[wsck] = ndb.Key(urlsafe=wsck)
+            except:
+                results[wsck] = 'Invalid conference key'
+        confs = {}
+        for wsck, conf in zip(list(c_keys), ndb.get_multi(list(c_keys.values()))):
+            if not conf or conf.key.kind() != 'Conference':
+                results[wsck] = 'No conference found with key: %s' % wsck
+            elif not conf.seatShards:
+                confs[wsck] = self._initSeatShards(conf.key)
+            else:
+                confs[wsck] = conf
+
+        # pick a shard with seats left for each conference from one read
+        shard_keys = [key for conf in confs.values() for key in self._seatShardKeys(conf)]
+        shards = dict(zip(shard_keys, ndb.get_multi(shard_keys)))
+        picks = []
+        for wsck in wscks:
+            if wsck not in confs:
+                continue
+            candidates = [key for key in self._seatShardKeys(confs[wsck])
+                          if shards[key] and shards[key].seats > 0]
+            if candidates:
+                picks.append((wsck, random.choice(candidates)))
+            else:
+                results[wsck] = "There are no seats available."
+
+        # the Profile and one shard per conference share each transaction,
+        # so chunk to stay within the entity group limit
+        for start in range(0, len(picks), MAX_TXN_SHARDS):
+            results.update(self._registerOnShards(picks[start:start + MAX_TXN_SHARDS]))
+        for wsck, s_key in picks:
+            # the chosen shard emptied meanwhile; fall back to trying all
+            if results[wsck] is None:
+                try:
+                    results[wsck] = self._changeRegistration(wsck)
+                except ConflictException as e:
+                    results[wsck] = str(e)
+            elif results[wsck] is True:
+                self._seatsTaken(confs[wsck].key, 1)
+
+        return RegistrationResultForms(items=[
+            RegistrationResultForm(websafeKey=wsck, registered=results[wsck] is True,
+                error=None if results[wsck] is True else results[wsck])
+            for wsck in wscks])
 
 
     @endpoints.method(GET_REQUEST, BooleanMessage,
@@ -252,33 +778,290 @@ class ConferenceApi(remote.Service):
         """Register user for selected conference."""
         return self._conferenceRegistration(request)
 
+    @endpoints.method(ConferenceKeysForm, RegistrationResultForms,
+            path='conferences/register',
+            http_method='POST', name='registerForConferences')
+    def registerForConferences(self, request):
+        """Register user for several conferences, reporting the result
+        for each."""
+        wscks = []
+        for wsck in request.websafeKeys:
+            if wsck not in wscks:
+                wscks.append(wsck)
+        return self._conferencesRegistration(wscks)
+
+# - - - Session registration - - - - - - - - - - - - - - - -
+    @staticmethod
+    def _sessionRegistrationKey(s_key, user_id):
+        """Return the SessionRegistration key of a user for a session."""
+        return ndb.Key(SessionRegistration, '%s:%s' % (s_key.urlsafe(), user_id))
+
+    @ndb.transactional(xg=True)
+    def _takeSessionSeat(self, r_key, s_key, user_id, shard_key):
+        """Record a seat at a session taken from one of its seat shards.
+        Returns None if the shard ran out of seats meanwhile."""
+        registration, shard = ndb.get_multi([r_key, shard_key])
+        if registration:
+            raise ConflictException(
+                "You have already registered for this session")
+        if shard.seats <= 0:
+            return None
+        shard.seats -= 1
+        ndb.put_multi([shard, SessionRegistration(key=r_key, session=s_key,
+                                                  userId=user_id, shard=shard_key)])
+        return True
+
+    @ndb.transactional(xg=True)
+    def _returnSessionSeat(self, r_key):
+        """Give a registered seat back to the shard it came from."""
+        registration = r_key.get()
+        if not registration:
+            return False
+        shard = registration.shard.get()
+        shard.seats += 1
+        shard.put()
+        r_key.delete()
+        return True
+
+    def _sessionRegistration(self, request, reg=True):
+        """Register or unregister user for selected session.  Each seat is
+        a SessionRegistration entity plus one seat shard, so concurrent
+        registrations neither contend on one entity nor lock the Profile."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+        try:
+            s_key = ndb.Key(urlsafe=request.websafeKey)
+        except:
+            s_key = None
+        session = s_key.get() if s_key and s_key.kind() == 'Session' else None
+        if not session:
+            raise endpoints.NotFoundException(
+                'No session found with key: %s' % request.websafeKey)
+        r_key = self._sessionRegistrationKey(s_key, user_id)
+
+        if reg:
+            if not session.seatShards:
+                session = self._initSeatShards(s_key)
+            candidates = [shard.key for shard in
+                          ndb.get_multi(self._seatShardKeys(session))
+                          if shard and shard.seats > 0]
+            random.shuffle(candidates)
+            retval = None
+            for shard_key in candidates:
+                retval = self._takeSessionSeat(r_key, s_key, user_id, shard_key)
+                if retval is not None:
+                    break
+            if retval is None:
+                raise ConflictException(
+                    "There are no seats available.")
+        else:
+            retval = self._returnSessionSeat(r_key)
+
+        if retval:
+            self._seatsTaken(s_key, 1 if reg else -1)
+        return BooleanMessage(data=retval)
+
+    @endpoints.method(GET_REQUEST, BooleanMessage,
+            path='session/{websafeKey}/register',
+            http_method='POST', name='registerForSession')
+    def registerForSession(self, request):
+        """Register user for selected session."""
+        return self._sessionRegistration(request)
+
+    @endpoints.method(GET_REQUEST, BooleanMessage,
+            path='session/{websafeKey}/unregister',
+            http_method='POST', name='unregisterFromSession')
+    def unregisterFromSession(self, request):
+        """Unregister user from selected session."""
+        return self._sessionRegistration(request, reg=False)
+
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
 
     def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters,CONFERENCEFIELDS)
+        """Return QueryPlan for the submitted conference filters."""
+        return self._planQuery(Conference, request.filters, CONFERENCEFIELDS,
+                               [Conference.name])
 
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
+    def _filterValue(self, model, field, value):
+        """Convert a filter value string to the type of the model property."""
+        prop = getattr(model, field)
+        try:
+            if field in MINUTEFIELDS:
+                value = datetime.strptime(value, "%H:%M")
+                return value.hour * 60 + value.minute
+            if isinstance(prop, ndb.IntegerProperty):
+                return int(value)
+            if isinstance(prop, ndb.DateProperty):
+                return datetime.strptime(value, "%Y-%m-%d").date()
+            if isinstance(prop, ndb.TimeProperty):
+                return datetime.strptime(value, "%H:%M").time()
+        except (TypeError, ValueError):
+            raise endpoints.BadRequestException(
+                "Invalid value (%s) for field %s." % (value, field))
+        return value
+
+    def _parseFilters(self, model, filters, validFields):
+        """Format user supplied filters, allowing any number of inequality
+        fields, with values converted to the model's property types."""
+        filters = self._formatFilters(filters, validFields)
+        for filtr in filters:
+            filtr["value"] = self._filterValue(model, filtr["field"], filtr["value"])
+        return filters
+
+    def _planQuery(self, model, filters, validFields, order):
+        """Return the QueryPlan for user supplied filters.
+
+        Filters a single query can serve are all given to the datastore,
+        sorted on the inequality field first and then by order, if a
+        built-in or declared index supports that query.  Otherwise the most
+        selective filters with built-in index support go to the datastore
+        (every equality, else the inequality field bounded on the most
+        sides) and the remaining ones, including any NE, are applied in
+        memory by _runQueryPlan.
+        """
+        filters = self._parseFilters(model, filters, validFields)
+        inequality_fields = []
+        for filtr in filters:
+            if filtr["operator"] not in ("=", "!=") and filtr["field"] not in inequality_fields:
+                inequality_fields.append(filtr["field"])
+        equality_fields = [filtr["field"] for filtr in filters
+                           if filtr["operator"] == "="]
+        single_order = [getattr(model, field) for field in inequality_fields] + order
+
+        if len(inequality_fields) <= 1 and \
+                not any(filtr["operator"] == "!=" for filtr in filters) and \
+                self._hasIndex(model._get_kind(), equality_fields,
+                               [prop._name for prop in single_order]):
+            pushed = filters
+            order = single_order
+        elif any(filtr["operator"] == "=" for filtr in filters):
+            # equalities merge-join over the built-in indexes, unordered
+            pushed = [filtr for filtr in filters if filtr["operator"] == "="]
+            order = []
+        elif inequality_fields:
+            # a range closed on both ends beats an open-ended one
+            def bounds(field):
+                return len(set(filtr["operator"][0] for filtr in filters
+                    if filtr["field"] == field and filtr["operator"] != "!="))
+            field = max(inequality_fields, key=bounds)
+            pushed = [filtr for filtr in filters
+                      if filtr["field"] == field and filtr["operator"] != "!="]
+            order = [getattr(model, field)]
         else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
+            # only NE filters; scan in the default order
+            pushed = []
+
+        q = model.query()
+        for filtr in pushed:
+            q = q.filter(COMPARATORS[filtr["operator"]](
+                getattr(model, filtr["field"]), filtr["value"]))
+        for prop in order:
+            q = q.order(prop)
+        return QueryPlan(q, [filtr for filtr in filters if filtr not in pushed])
 
+    @staticmethod
+    def _hasIndex(kind, equality_fields, order_fields):
+        """Return True if a query of kind with equality filters on
+        equality_fields, sorted ascending by order_fields, is served by a
+        built-in index or one in COMPOSITE_INDEXES (read from index.yaml)."""
+        if not order_fields:
+            # equalities alone merge-join over the built-in indexes
+            return True
+        if not equality_fields and len(order_fields) == 1:
+            return True
+        n = len(equality_fields)
+        return any(len(props) == n + len(order_fields) and
+                   sorted(props[:n]) == sorted(equality_fields) and
+                   list(props[n:]) == list(order_fields)
+                   for props in COMPOSITE_INDEXES.get(kind, ()))
+
+    @staticmethod
+    def _matchesFilters(values, filters):
+        """Return True if values(field) matches every formatted filter;
+        a list value matches if any of its items does."""
         for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
-    
-  
+            value = values(filtr["field"])
+            compare = COMPARATORS[filtr["operator"]]
+            if not any(item is not None and compare(item, filtr["value"])
+                       for item in (value if isinstance(value, list) else [value])):
+                return False
+        return True
+
+    def _runQueryPlan(self, plan, request):
+        """Fetch the page of a QueryPlan's results selected by a QueryForms;
+        returns (results, nextPageToken).  In-memory filters are applied as
+        results stream in, examining at most MAX_SCAN entities, so a page
+        may come back short with a nextPageToken to continue from."""
+        if not plan.residual:
+            return self._fetchPage(plan.query, request)
+        page_size = self._pageSize(request)
+        results = []
+        scanned = 0
+        it = plan.query.iter(start_cursor=self._pageCursor(request),
+                             produce_cursors=True, batch_size=SCAN_BATCH_SIZE)
+        for entity in it:
+            scanned += 1
+            if self._matchesFilters(lambda field: getattr(entity, field), plan.residual):
+                results.append(entity)
+            if len(results) == page_size or scanned == MAX_SCAN:
+                break
+        if it.has_next():
+            return results, it.cursor_after().urlsafe()
+        return results, None
+
+    def _pageSize(self, request):
+        """Return the validated pageSize of a QueryForms."""
+        page_size = request.pageSize or DEFAULT_PAGE_SIZE
+        if not 0 < page_size <= MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "pageSize must be between 1 and %d" % MAX_PAGE_SIZE)
+        return page_size
+
+    def _listPage(self, items, request):
+        """Return the page of an in-memory list selected by a QueryForms;
+        the page token is the offset of the next page."""
+        page_size = self._pageSize(request)
+        offset = self._pageOffset(request)
+        if offset + page_size < len(items):
+            return items[offset:offset + page_size], str(offset + page_size)
+        return items[offset:], None
+
+    def _pageOffset(self, request):
+        """Return the offset pageToken of a QueryForms paged by offset."""
+        try:
+            offset = int(request.pageToken or 0)
+        except ValueError:
+            offset = -1
+        if offset < 0:
+            raise endpoints.BadRequestException(
+                "Invalid pageToken: %s" % request.pageToken)
+        return offset
+
+    def _pageCursor(self, request):
+        """Return the datastore Cursor of a QueryForms pageToken, or None."""
+        if not request.pageToken:
+            return None
+        try:
+            return Cursor(urlsafe=request.pageToken)
+        except:
+            raise endpoints.BadRequestException(
+                "Invalid pageToken: %s" % request.pageToken)
+
+    def _fetchPage(self, query, request):
+        """Fetch the page of query results selected by the pageSize and
+        pageToken of a QueryForms; returns (results, nextPageToken)."""
+        results, next_cursor, more = query.fetch_page(
+            self._pageSize(request), start_cursor=self._pageCursor(request))
+        if more and next_cursor:
+            return results, next_cursor.urlsafe()
+        return results, None
+
     def _formatFilters(self, filters, validFields):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
@@ -289,18 +1072,8 @@ class ConferenceApi(remote.Service):
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field (%s) or operator."%filtr["field"])
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
-
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return formatted_filters
 
 
     def _copyConferenceToForm(self, conf, displayName):
@@ -320,15 +1093,52 @@ class ConferenceApi(remote.Service):
         cf.check_initialized()
         return cf
 
+    def _copyConferencesToForms(self, conferences, displayName=None):
+        """Return ConferenceForms for a list of conferences, with seat
+        counts and (unless displayName is given) organizer names
+        resolved in batches."""
+        conferences = [conf for conf in conferences if conf]
+        seats = self._getSeatsAvailableMulti(conferences)
+        if displayName is None:
+            names = self._getOrganizerNames([conf.key.parent() for conf in conferences])
+        items = []
+        for conf in conferences:
+            if displayName is None:
+                cf = self._copyConferenceToForm(conf, names[conf.key.parent()])
+            else:
+                cf = self._copyConferenceToForm(conf, displayName)
+            cf.seatsAvailable = seats[conf.key.urlsafe()]
+            items.append(cf)
+        return ConferenceForms(items=items)
 
-    def _createConferenceObject(self, request):
-        """Create or update Conference object, returning ConferenceForm/request."""
-        # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
-
+    @staticmethod
+    def _getOrganizerNames(p_keys):
+        """Return {Profile key: displayName} for organizer Profile keys;
+        names not in memcache are read with a single get_multi of the
+        distinct Profiles."""
+        p_keys = list(set(p_keys))
+        cached = memcache.get_multi([p_key.urlsafe() for p_key in p_keys],
+                                    key_prefix=MEMCACHE_ORGANIZER_PREFIX)
+        names = {}
+        missing = []
+        for p_key in p_keys:
+            if p_key.urlsafe() in cached:
+                names[p_key] = cached[p_key.urlsafe()]
+            else:
+                missing.append(p_key)
+        if missing:
+            fetched = {}
+            for p_key, prof in zip(missing, ndb.get_multi(missing)):
+                names[p_key] = getattr(prof, 'displayName', None) or ""
+                fetched[p_key.urlsafe()] = names[p_key]
+            memcache.set_multi(fetched, key_prefix=MEMCACHE_ORGANIZER_PREFIX)
+        return names
+
+
+    def _conferenceFromForm(self, request, c_key):
+        """Return a new Conference with key c_key (parent: the organizer's
+        Profile) and its SeatShards from a ConferenceForm, filling in
+        defaults on both; raises BadRequestException for invalid input."""
         if not request.name:
             raise endpoints.BadRequestException("Conference 'name' field required")
 
@@ -344,13 +1154,17 @@ class ConferenceApi(remote.Service):
                 setattr(request, df, DEFAULTS[df])
 
         # convert dates from strings to Date objects; set month based on start_date
-        if data['startDate']:
-            data['startDate'] = datetime.strptime(data['startDate'][:10], "%Y-%m-%d").date()
-            data['month'] = data['startDate'].month
-        else:
-            data['month'] = 0
-        if data['endDate']:
-            data['endDate'] = datetime.strptime(data['endDate'][:10], "%Y-%m-%d").date()
+        try:
+            if data['startDate']:
+                data['startDate'] = datetime.strptime(data['startDate'][:10], "%Y-%m-%d").date()
+                data['month'] = data['startDate'].month
+            else:
+                data['month'] = 0
+            if data['endDate']:
+                data['endDate'] = datetime.strptime(data['endDate'][:10], "%Y-%m-%d").date()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Invalid startDate (%s) or endDate (%s)" % (data['startDate'], data['endDate']))
 
         # set seatsAvailable to be same as maxAttendees on creation
         # both for data model & outbound Message
@@ -358,24 +1172,158 @@ class ConferenceApi(remote.Service):
             data["seatsAvailable"] = data["maxAttendees"]
             setattr(request, "seatsAvailable", data["maxAttendees"])
 
+        data['key'] = c_key
+        data['organizerUserId'] = request.organizerUserId = c_key.parent().id()
+
+        # split the seats over SeatShards so registrations don't all
+        # contend on the Conference entity
+        shards = self._makeSeatShards(c_key, data['seatsAvailable'])
+        data['seatShards'] = len(shards)
+        return Conference(**data), shards
+
+    def _putConferences(self, conferences, shards):
+        """Store new conferences together with their seat shards."""
+        ndb.put_multi(conferences + shards)
+        self._indexConferences(conferences)
+        self._queueFacetCounts([conf.key for conf in conferences])
+        nearly = [conf.key for conf in conferences
+                  if self._isNearlySoldOut(conf.seatsAvailable)]
+        if nearly and ndb.transaction(
+                lambda: self._setNearlySoldOut(nearly, True)):
+            cache.invalidate(MEMCACHE_ANNOUNCEMENTS_KEY)
+
+    def _createConferenceObject(self, request):
+        """Create or update Conference object, returning ConferenceForm/request."""
+        # preload necessary data items
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+
+        if not request.name:
+            raise endpoints.BadRequestException("Conference 'name' field required")
+
         # make Profile Key from user ID
         p_key = ndb.Key(Profile, user_id)
         # allocate new Conference ID with Profile key as parent
         c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
         # make Conference key from ID
         c_key = ndb.Key(Conference, c_id, parent=p_key)
-        data['key'] = c_key
-        data['organizerUserId'] = request.organizerUserId = user_id
+        conf, shards = self._conferenceFromForm(request, c_key)
 
         # create Conference & return (modified) ConferenceForm
-        Conference(**data).put()
+        self._putConferences([conf], shards)
+        cache.bumpGeneration(c_key.urlsafe())
         # creation of Conference & return (modified) ConferenceForm
         taskqueue.add(params={'email': user.email(),
             'conferenceInfo': repr(request)},
             url='/tasks/send_confirmation_email'
         )
         return request
-    
+
+# - - - Conference import - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def _parseImportLine(job, line):
+        """Return the field dict of one CSV or JSON-lines import record."""
+        if job.fileFormat == 'json':
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError("expected a JSON object")
+            return row
+        values = next(csv.reader([line]))
+        if len(values) != len(job.columns):
+            raise ValueError("expected %d columns, found %d" % (len(job.columns), len(values)))
+        row = dict(zip(job.columns, values))
+        if row.get('topics'):
+            row['topics'] = [topic.strip() for topic in row['topics'].split(';')]
+        return row
+
+    def _importConferences(self, import_id, offset):
+        """Import the next batch of records of a ConferenceImport, starting
+        at byte offset of its upload, then checkpoint and queue the next
+        batch; called from the task queue."""
+        job = ndb.Key(ConferenceImport, import_id).get()
+        # a duplicate or stale task finds the checkpoint already moved on
+        if not job or job.done or job.offset != offset:
+            return
+
+        reader = blobstore.BlobReader(job.blobKey)
+        reader.seek(job.offset)
+        line_number = job.lineNumber
+        rows = []
+        eof = False
+        while line_number - job.lineNumber < IMPORT_BATCH_SIZE:
+            raw = reader.readline()
+            if not raw:
+                eof = True
+                break
+            line_number += 1
+            line = raw.strip()
+            if not line:
+                continue
+            if job.fileFormat == 'csv' and not job.columns:
+                job.columns = [column.strip() for column in next(csv.reader([line]))]
+                continue
+            try:
+                rows.append((line_number, self._parseImportLine(job, line)))
+            except ValueError as e:
+                job.errors.append("line %d: %s" % (line_number, e))
+
+        # organizers are keyed by email; create Profiles for new ones
+        p_keys = list(set(ndb.Key(Profile, row['organizerEmail'])
+                          for number, row in rows if row.get('organizerEmail')))
+        profiles = [Profile(key=p_key, displayName=p_key.id(), mainEmail=p_key.id(),
+                            teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED))
+                    for p_key, prof in zip(p_keys, ndb.get_multi(p_keys)) if not prof]
+
+        conferences = []
+        shards = []
+        for number, row in rows:
+            try:
+                if not row.get('organizerEmail'):
+                    raise ValueError("organizerEmail is required")
+                form = ConferenceForm(
+                    name=row.get('name'),
+                    description=row.get('description'),
+                    topics=row.get('topics') or [],
+                    city=row.get('city'),
+                    startDate=row.get('startDate'),
+                    endDate=row.get('endDate'),
+                    maxAttendees=int(row.get('maxAttendees') or 0))
+                # ids derive from the import and line so a retried batch
+                # overwrites its own conferences instead of duplicating them
+                c_key = ndb.Key(Conference, 'import-%d-%d' % (import_id, number),
+                                parent=ndb.Key(Profile, row['organizerEmail']))
+                conf, conf_shards = self._conferenceFromForm(form, c_key)
+            except (ValueError, TypeError, messages.ValidationError,
+                    endpoints.BadRequestException) as e:
+                job.errors.append("line %d: %s" % (number, e))
+                continue
+            conferences.append(conf)
+            shards.extend(conf_shards)
+
+        ndb.put_multi(profiles)
+        self._putConferences(conferences, shards)
+
+        # checkpoint and chain the next batch in one transaction, unless
+        # another task (e.g. a resumed chain) checkpointed this batch first
+        job.offset = reader.tell()
+        job.lineNumber = line_number
+        job.imported += len(conferences)
+        job.errors = job.errors[-MAX_IMPORT_ERRORS:]
+        job.done = eof
+
+        @ndb.transactional
+        def _checkpoint():
+            current = job.key.get()
+            if current.done or current.offset != offset:
+                return
+            job.put()
+            if not job.done:
+                taskqueue.add(params={'id': import_id, 'offset': job.offset},
+                    url='/tasks/import_conferences', transactional=True)
+        _checkpoint()
+
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
     def createConference(self, request):
@@ -388,27 +1336,40 @@ class ConferenceApi(remote.Service):
             name='queryConferences')
     def queryConferences(self, request):
         """Query for conferences."""
-        conferences = self._getQuery(request)
+        conferences, next_token = self._runQueryPlan(self._getQuery(request), request)
 
         # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") \
-            for conf in conferences]
-        )
+        forms = self._copyConferencesToForms(conferences)
+        forms.nextPageToken = next_token
+        return forms
     
     @endpoints.method(GET_REQUEST, ConferenceForm,
             path='conference/{websafeKey}',
             http_method='GET', name='getConference')    
     def getConference(self, request):
         """Return requested conference (by websafeKey)."""
+        c_key = ndb.Key(urlsafe=request.websafeKey)
+        cf = cache.readThrough('conference',
+            cache.versionedKey('conference', c_key.urlsafe()),
+            lambda: protojson.encode_message(self._getConferenceForm(c_key)))
+        cf = protojson.decode_message(ConferenceForm, cf)
+        # the organizer's name is kept out of the cached form, since a
+        # profile rename only clears the organizer name cache
+        cf.organizerDisplayName = self._getOrganizerNames([c_key.parent()])[c_key.parent()]
+        return cf
+
+    def _getConferenceForm(self, c_key):
+        """Return ConferenceForm, without organizer name, for a conference
+        key read from the datastore."""
         # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeKey).get()
+        conf = c_key.get()
         if not conf:
             raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeKey)
-        prof = conf.key.parent().get()
+                'No conference found with key: %s' % c_key.urlsafe())
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        cf = self._copyConferenceToForm(conf, None)
+        cf.seatsAvailable = self._getSeatsAvailable(conf)
+        return cf
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='getConferencesCreated',
@@ -423,14 +1384,12 @@ class ConferenceApi(remote.Service):
         # make profile key
         p_key = ndb.Key(Profile, getUserId(user))
         # create ancestor query for this user
-        conferences = Conference.query(ancestor=p_key)
+        conferences = Conference.query(ancestor=p_key).fetch()
         # get the user profile and display name
         prof = p_key.get()
         displayName = getattr(prof, 'displayName')
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, displayName) for conf in conferences]
-        )
+        return self._copyConferencesToForms(conferences, displayName)
       
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='conferences/attending',
@@ -454,16 +1413,10 @@ class ConferenceApi(remote.Service):
         except:
             raise endpoints.NotFoundException('Registration required')
         prof = p_key.get()
-        array_of_wskeys=getattr(prof,'conferenceKeysToAttend')
-        conferences=[]
-        if array_of_wskeys:
-            array_of_keys = [ndb.Key(urlsafe=wskey) for wskey in array_of_wskeys]
-            conferences = ndb.get_multi(array_of_keys)
+        conferences = ndb.get_multi(prof.conferenceKeysToAttend)
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, "")\
-         for conf in conferences]
-        )
+        return self._copyConferencesToForms(conferences)
                 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
         path='filterPlayground',
@@ -499,18 +1452,183 @@ class ConferenceApi(remote.Service):
         # 1: city equals to London
         # 2: topic equals "Medical Innovations"
 
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf in q]
-        )
+        return self._copyConferencesToForms(q.fetch())
+
+
+# - - - Facet counts - - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def _seatsBucket(seats):
+        """Return the seats facet value for a number of seats available."""
+        for bound, bucket in SEAT_BUCKETS:
+            if (seats or 0) <= bound:
+                return bucket
+        return SEAT_BUCKET_MAX
+
+    @staticmethod
+    def _conferenceFacets(conf):
+        """Return the [(facet, value)] a conference is counted under."""
+        facets = [('topics', topic) for topic in set(conf.topics or [])]
+        if conf.city:
+            facets.append(('city', conf.city))
+        if conf.month:
+            facets.append(('month', str(conf.month)))
+        facets.append(('seats', ConferenceApi._seatsBucket(conf.seatsAvailable)))
+        return facets
+
+    @staticmethod
+    def _scopedFacets(conf):
+        """Return {scope: sorted [[facet, value]]} a conference should be
+        counted under; empty for a missing conference."""
+        if not conf:
+            return {}
+        facets = sorted([facet, value] for facet, value
+                        in ConferenceApi._conferenceFacets(conf))
+        return dict((scope, facets) for scope in [FACET_SCOPE_ALL] +
+                    ['%s:%s' % tuple(fv) for fv in facets])
+
+    @staticmethod
+    def _facetShardKeys(scope):
+        return [ndb.Key(FacetCounts, '%s#%d' % (scope, shard))
+                for shard in range(FACET_SHARDS)]
+
+    @staticmethod
+    def _queueFacetCounts(c_keys):
+        """Queue the facet count updates of conferences, FACET_TASK_SIZE
+        conferences per task."""
+        tasks = [taskqueue.Task(url='/tasks/count_facets', params={
+                     'websafeKey': [c_key.urlsafe() for c_key in
+                                    c_keys[i:i + FACET_TASK_SIZE]]})
+                 for i in range(0, len(c_keys), FACET_TASK_SIZE)]
+        for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+            taskqueue.Queue().add(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+
+    @staticmethod
+    def _countFacets(c_keys):
+        """Bring the facet counts of conferences up to date; called from
+        the task queue.  Each scope is moved from the facets recorded in
+        the conference's CountedFacets to its current ones in a transaction
+        that also updates the record, so running this again (a retried
+        task, or a mapper batch) changes nothing.  A conference always
+        counts in the same one of the FACET_SHARDS shards of a scope."""
+        @ndb.transactional(xg=True)
+        def _move(c_key, m_key, scope):
+            conf, counted = ndb.get_multi([c_key, m_key])
+            counted = counted or CountedFacets(key=m_key, scopes={})
+            old = counted.scopes.get(scope, [])
+            new = ConferenceApi._scopedFacets(conf).get(scope, [])
+            if old == new:
+                return
+            shard_key = ConferenceApi._facetShardKeys(scope)[
+                zlib.crc32(c_key.urlsafe()) % FACET_SHARDS]
+            shard = shard_key.get() or FacetCounts(key=shard_key, counts={})
+            for facets, sign in ((old, -1), (new, 1)):
+                for facet, value in facets:
+                    counts = shard.counts.setdefault(facet, {})
+                    counts[value] = counts.get(value, 0) + sign
+                    if counts[value] <= 0:
+                        del counts[value]
+            if new:
+                counted.scopes[scope] = new
+            else:
+                counted.scopes.pop(scope, None)
+            ndb.put_multi([counted, shard])
+
+        for c_key in c_keys:
+            m_key = ndb.Key(CountedFacets, 1, parent=c_key)
+            conf, counted = ndb.get_multi([c_key, m_key])
+            old = counted.scopes if counted else {}
+            new = ConferenceApi._scopedFacets(conf)
+            for scope in set(old) | set(new):
+                if old.get(scope) != new.get(scope):
+                    _move(c_key, m_key, scope)
+
+    @endpoints.method(FACETS_REQUEST, FacetCountForms,
+            path='conferences/facets',
+            http_method='GET', name='getConferenceFacets')
+    def getConferenceFacets(self, request):
+        """Return conference counts per city, month, topic and seats
+        available bucket, optionally only of conferences having the given
+        facet value."""
+        scope = FACET_SCOPE_ALL
+        if request.facet:
+            if request.facet not in FACETS or not request.value:
+                raise endpoints.BadRequestException(
+                    "facet must be one of %s, with a value" % ', '.join(FACETS))
+            scope = '%s:%s' % (request.facet, request.value)
+        counts = {}
+        for shard in ndb.get_multi(self._facetShardKeys(scope)):
+            for facet, values in (shard.counts if shard else {}).items():
+                value_counts = counts.setdefault(facet, {})
+                for value, count in values.items():
+                    value_counts[value] = value_counts.get(value, 0) + count
+        return FacetCountForms(items=[
+            FacetCountForm(facet=facet, value=value, count=counts[facet][value])
+            for facet in FACETS for value in sorted(counts.get(facet, {}))])
+
+# - - - Search - - - - - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def _indexConferences(conferences):
+        """Add conferences to the search index; name counts most."""
+        search.indexDocuments([(conf.key, [(conf.name, 3),
+                                           (' '.join(conf.topics or []), 2),
+                                           (conf.description, 1)])
+                               for conf in conferences])
+
+    @staticmethod
+    def _indexSessions(sessions):
+        """Add sessions to the search index; name counts most."""
+        search.indexDocuments([(session.key, [(session.name, 3),
+                                              (session.description, 1)])
+                               for session in sessions])
+
+    def _searchPage(self, kind, request):
+        """Return the entities on the requested page of ranked search
+        results for kind, and the next page token."""
+        tokens = sorted(set(search.tokenize(request.query)))
+        if not tokens:
+            raise endpoints.BadRequestException("Search 'query' required")
+        # rank once per query; later pages reuse the ranked key list
+        query_id = u'%s:%s' % (kind, u' '.join(tokens))
+        ranked = cache.readThrough('search',
+            MEMCACHE_SEARCH_PREFIX + hashlib.sha1(query_id.encode('utf-8')).hexdigest(),
+            lambda: [key.urlsafe() for key in search.search(kind, request.query)],
+            time=SEARCH_CACHE_TIME)
+        wsks, next_token = self._listPage(ranked, request)
+        return [entity for entity in ndb.get_multi([ndb.Key(urlsafe=wsk) for wsk in wsks])
+                if entity], next_token
+
+    @endpoints.method(SEARCH_REQUEST, ConferenceForms,
+            path='conferences/search',
+            http_method='GET', name='searchConferences')
+    def searchConferences(self, request):
+        """Search conference names, topics and descriptions by keyword."""
+        conferences, next_token = self._searchPage('Conference', request)
+        forms = self._copyConferencesToForms(conferences)
+        forms.nextPageToken = next_token
+        return forms
+
+    @endpoints.method(SEARCH_REQUEST, SessionForms,
+            path='sessions/search',
+            http_method='GET', name='searchSessions')
+    def searchSessions(self, request):
+        """Search session names and descriptions by keyword."""
+        sessions, next_token = self._searchPage('Session', request)
+        return SessionForms(
+            items=[self._copySessionToForm(session) for session in sessions],
+            nextPageToken=next_token)
 
 
 # - - - Session objects - - - - - - - - - - - - - - - - -
     
-    def _createSessionObject(self, request,c_key,cname,user):
-        """Create or update Session object, returning SessionForm/request."""
+    def _sessionFromForm(self, request):
+        """Return a new Session, without key, from a SessionForm, filling in
+        defaults on both; raises BadRequestException for invalid input."""
         # copy SessionForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
+        for field in SESSIONREQUIRED:
+            if data[field] in (None, ''):
+                raise endpoints.BadRequestException("Session '%s' field required" % field)
                       
         # add default values for those missing (both data model & outbound Message)
         for df in SESSIONDEFAULTS:
@@ -519,47 +1637,52 @@ class ConferenceApi(remote.Service):
                 setattr(request, df, SESSIONDEFAULTS[df])
 
         # convert date and time from strings to Date objects
-        if data['date']:
+        try:
             data['date'] = datetime.strptime(data['date'], "%Y-%m-%d").date()
-        if data['time']:
             data['time'] = datetime.strptime(data['time'],"%H:%M").time()
-        # convert enum to string
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Invalid date (%s) or time (%s)" % (data['date'], data['time']))
+        # convert enum to string; leave the model default if missing
         if data['sessionType']:
              data['sessionType'] = str(data['sessionType'])
+        else:
+             del data['sessionType']
         # set seatsAvailable to be same as maxAttendees on creation
         # both for data model & outbound Message
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
             setattr(request, "seatsAvailable", data["maxAttendees"])
+        return Session(**data)
 
-        # allocate new Session ID with Conference key as parent
-        s_id = Session.allocate_ids(size=1, parent=c_key)[0]
-        # make Session key from ID
+    def _createSessionObject(self, request,c_key,s_id,spkr,user):
+        """Create Session object with the allocated id s_id for the given
+        Speaker, returning SessionForm."""
+        session = self._sessionFromForm(request)
+        # make Session key from the ID allocated with Conference key as parent
         s_key = ndb.Key(Session, s_id, parent=c_key)
-        data['key'] = s_key
-        # add the session to the speakers list
-        spkr = ndb.Key(Speaker,data['speaker']).get()
-        array_of_wskeys=getattr(spkr,'sessionKeys')     
-        count=1
-        # determine how many sessions this speaker is presenting at this conference
-        if array_of_wskeys:
-             for wskey in array_of_wskeys:
-                 if ndb.Key(urlsafe=wskey).parent()==c_key:
-                     logging.info("session id=%d"%ndb.Key(urlsafe=wskey).id())
-                     count+=1    
- 
-        # create Session 
+        session.key = s_key
+        # determine whether this speaker already presents at this conference;
+        # ancestor + equality on the indexed speaker property is served by
+        # the built-in indexes and stops at the first matching key
+        repeat_speaker = Session.query(Session.speaker == session.speaker,
+            ancestor=c_key).get(keys_only=True) is not None
+
+        # create Session, update the speaker and add the session to the
+        # conference schedule together
         try:
-            Session(**data).put()
-            spkr.sessionKeys.append(s_key.urlsafe())
-            spkr.put()
+            self._putSessionsWithSchedule(c_key, [session])
+        except ConflictException:
+            raise
         except:
             raise endpoints.BadRequestException("Database update failed")
+        cache.bumpGeneration(c_key.urlsafe())
+        self._indexSessions([session])
 
         # if speaker is presenting 2 or more sessions
         # add a task to check if this speaker is now a featured speaker
-        if count >= 2:             
-            taskqueue.add(params={'conference': c_key.urlsafe(),'speaker':data['speaker']},url='/tasks/featuredSpeaker')
+        if repeat_speaker:
+            taskqueue.add(params={'conference': c_key.urlsafe(),'speaker':session.speaker},url='/tasks/featuredSpeaker')
         #send email to creator
         taskqueue.add(params={'email': user.email(),
             'sessionInfo': repr(request)},
@@ -567,7 +1690,110 @@ class ConferenceApi(remote.Service):
         )
 
         #return session form
-        return self._copySessionToForm(s_key.get())
+        return self._copySessionToForm(session)
+
+    def _createSessionObjects(self, forms, c_key, user):
+        """Create a Session per SessionForm for one conference in bulk,
+        returning a SessionResultForm per form in the same order."""
+        results = [SessionResultForm() for form in forms]
+        sessions = {}
+        for i, form in enumerate(forms):
+            try:
+                sessions[i] = self._sessionFromForm(form)
+            except endpoints.BadRequestException as e:
+                results[i].error = str(e)
+        if not sessions:
+            return SessionResultForms(items=results)
+
+        # speakers, whether each already presents here, and ids for every
+        # session are all requested before waiting on any of them
+        speaker_ids = sorted(set(session.speaker for session in sessions.values()))
+        speaker_futures = ndb.get_multi_async([ndb.Key(Speaker, speaker_id)
+                                               for speaker_id in speaker_ids])
+        repeat_futures = [Session.query(Session.speaker == speaker_id,
+                              ancestor=c_key).get_async(keys_only=True)
+                          for speaker_id in speaker_ids]
+        ids_future = Session.allocate_ids_async(size=len(sessions), parent=c_key)
+        speakers = dict(zip(speaker_ids, [f.get_result() for f in speaker_futures]))
+        presenting = dict(zip(speaker_ids, [1 if f.get_result() else 0
+                                            for f in repeat_futures]))
+        first_id, last_id = ids_future.get_result()
+
+        for i, s_id in zip(sorted(sessions), range(first_id, last_id + 1)):
+            if not speakers[sessions[i].speaker]:
+                results[i].error = 'No speaker found with key: %s' % sessions[i].speaker
+                del sessions[i]
+            else:
+                sessions[i].key = ndb.Key(Session, s_id, parent=c_key)
+
+        # reject sessions double-booking a speaker or room, against the
+        # schedule and the sessions before them in this batch; the
+        # transaction storing each chunk checks again
+        bookings = self._loadSchedule(c_key).bookings
+        for i in sorted(sessions):
+            entry = self._scheduleEntry(sessions[i])
+            conflict = self._findBookingConflict(bookings, entry)
+            if conflict:
+                results[i].error = conflict
+                del sessions[i]
+            else:
+                self._addBooking(bookings, entry)
+
+        # each chunk is stored in one transaction with the conference's
+        # schedule and its speakers, so it must stay within the limits on
+        # entity groups per transaction and entities per put
+        chunks = []
+        for i in sorted(sessions):
+            if not chunks or len(chunks[-1]) >= MAX_BATCH_SESSIONS or (
+                    sessions[i].speaker not in chunk_speakers and
+                    len(chunk_speakers) >= MAX_TXN_SPEAKERS):
+                chunks.append([])
+                chunk_speakers = set()
+            chunks[-1].append(i)
+            chunk_speakers.add(sessions[i].speaker)
+
+        created = []
+        for chunk in chunks:
+            try:
+                self._putSessionsWithSchedule(c_key, [sessions[i] for i in chunk])
+            except Exception as e:
+                logging.exception("Creating sessions failed")
+                for i in chunk:
+                    results[i].error = str(e) if isinstance(e, ConflictException) \
+                        else "Database update failed"
+                continue
+            for i in chunk:
+                presenting[sessions[i].speaker] += 1
+                results[i].session = self._copySessionToForm(sessions[i])
+                created.append(forms[i])
+        if not created:
+            return SessionResultForms(items=results)
+        cache.bumpGeneration(c_key.urlsafe())
+        self._indexSessions([sessions[i] for i in sessions
+                             if results[i].session is not None])
+
+        # one featured speaker check per repeat speaker, and one email
+        # summing up the sessions, kept well below the task size limit
+        names = [form.name for form in created[:MAX_EMAIL_SESSIONS]]
+        if len(created) > MAX_EMAIL_SESSIONS:
+            names.append('and %d more' % (len(created) - MAX_EMAIL_SESSIONS))
+        tasks = [taskqueue.Task(params={'conference': c_key.urlsafe(),
+                                        'speaker': speaker_id},
+                                url='/tasks/featuredSpeaker')
+                 for speaker_id in speaker_ids if presenting[speaker_id] >= 2]
+        tasks.append(taskqueue.Task(params={'email': user.email(),
+            'sessionInfo': '%d sessions created:\r\n%s' % (
+                len(created), '\r\n'.join(names))},
+            url='/tasks/send_confirmation_email'))
+        # the sessions are committed; failing to queue follow-up work must
+        # not report them as failed
+        queue = taskqueue.Queue()
+        for start in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+            try:
+                queue.add(tasks[start:start + taskqueue.MAX_TASKS_PER_ADD])
+            except (taskqueue.Error, apiproxy_errors.Error):
+                logging.exception("Queueing tasks after creating sessions failed")
+        return SessionResultForms(items=results)
     
     def _copySessionToForm(self, session):
         """Copy relevant fields from Session to SessionForm."""
@@ -586,35 +1812,232 @@ class ConferenceApi(remote.Service):
         ses.check_initialized()
         return ses
     
-    def _getSessionQuery(self, request, parent=None):
-        """Return formatted session query from the submitted filters."""
-        if parent != None:
-            q = Session.query(ancestor=parent)
-        else:
-            q = Session.query()
-        inequality_filter, filters = self._formatFilters(request.filters,SESSIONFIELDS)
+# - - - Session schedules - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def _scheduleEntry(session):
+        """Return the ConferenceSchedule entry for a Session."""
+        return {
+            'websafeKey': session.key.urlsafe(),
+            'name': session.name,
+            'speaker': session.speaker,
+            'date': session.date.isoformat(),
+            'time': session.time.isoformat(),
+            'duration': session.duration,
+            'location': session.location,
+            'sessionType': session.sessionType,
+            'maxAttendees': session.maxAttendees,
+            'seatsAvailable': session.seatsAvailable,
+            'description': ConferenceApi._descriptionSnippet(session.description),
+        }
 
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Session.date)
-            q = q.order(Session.time)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Session.date)
-            q = q.order(Session.time)
+    @staticmethod
+    def _descriptionSnippet(description):
+        """Return description cut to SCHEDULE_DESCRIPTION_LENGTH characters,
+        so schedules stay small however long descriptions get."""
+        if description and len(description) > SCHEDULE_DESCRIPTION_LENGTH:
+            return description[:SCHEDULE_DESCRIPTION_LENGTH - 3].rstrip() + '...'
+        return description
+
+    @staticmethod
+    def _scheduleKey(c_key):
+        """Return the ConferenceSchedule key of a conference."""
+        return ndb.Key(ConferenceSchedule, 1, parent=c_key)
+
+    @staticmethod
+    def _loadSchedule(c_key):
+        """Return the ConferenceSchedule of a conference, building it from
+        the conference's sessions if it doesn't exist yet."""
+        schedule = ConferenceApi._scheduleKey(c_key).get()
+        if not schedule:
+            schedule = ConferenceSchedule(key=ConferenceApi._scheduleKey(c_key),
+                sessions=[ConferenceApi._scheduleEntry(session)
+                          for session in Session.query(ancestor=c_key)])
+        if schedule.sessions is None:
+            schedule.sessions = []
+        # entries stored with full descriptions shrink on the next write
+        for entry in schedule.sessions:
+            if entry.get('description'):
+                entry['description'] = ConferenceApi._descriptionSnippet(entry['description'])
+        # bookings stored before the running latest end was kept are rebuilt
+        if schedule.bookings is None or any(
+                len(booked[0]) < 5 for booked in schedule.bookings.values() if booked):
+            schedule.bookings = ConferenceApi._buildBookings(schedule.sessions)
+        return schedule
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _putSessionsWithSchedule(c_key, sessions):
+        """Put new sessions of a conference, adding them to the conference
+        schedule and to their speakers' sessionKeys atomically; raises
+        ConflictException if one would double-book a speaker or room.
+        Speakers are read inside the transaction so that concurrent
+        session creation doesn't lose keys."""
+        speaker_keys = sorted(set(ndb.Key(Speaker, session.speaker)
+                                  for session in sessions))
+        speakers = dict(zip(speaker_keys, ndb.get_multi(speaker_keys)))
+        schedule = ConferenceApi._loadSchedule(c_key)
+        entries = [ConferenceApi._scheduleEntry(session) for session in sessions]
+        for entry in entries:
+            conflict = ConferenceApi._findBookingConflict(schedule.bookings, entry)
+            if conflict:
+                raise ConflictException(conflict)
+            ConferenceApi._addBooking(schedule.bookings, entry)
+        for session in sessions:
+            speaker = speakers[ndb.Key(Speaker, session.speaker)]
+            if speaker and session.key not in speaker.sessionKeys:
+                speaker.sessionKeys.append(session.key)
+        schedule.sessions.extend(entries)
+        schedule.sessions.sort(key=lambda entry: (entry['date'], entry['time']))
+        ndb.put_multi(list(sessions) + [speaker for speaker in speakers.values()
+                                        if speaker] + [schedule])
+
+    @staticmethod
+    def _bookingSpan(entry):
+        """Return the (start, end) minutes since 0001-01-01 of a schedule
+        entry."""
+        start = datetime.strptime(entry['date'], '%Y-%m-%d').toordinal() * 1440 + \
+            int(entry['time'][0:2]) * 60 + int(entry['time'][3:5])
+        return start, start + (entry['duration'] or 0)
 
+    @staticmethod
+    def _bookingResources(entry):
+        """Return the bookings keys of the speaker and room of an entry."""
+        resources = ['speaker:%s' % entry['speaker']]
+        if entry['location']:
+            resources.append('location:%s' % ' '.join(entry['location'].lower().split()))
+        return resources
+
+    @staticmethod
+    def _buildBookings(entries):
+        """Return {resource: [[start, end, websafeKey, latestEnd,
+        latestKey]] sorted by start} for schedule entries, where latestEnd
+        is the latest end of the intervals up to and including this one
+        and latestKey the session ending then."""
+        bookings = {}
+        for entry in entries:
+            ConferenceApi._addBooking(bookings, entry)
+        return bookings
+
+    @staticmethod
+    def _addBooking(bookings, entry):
+        """Add a schedule entry to the bookings of its speaker and room,
+        raising the latest end of the intervals after it where needed."""
+        start, end = ConferenceApi._bookingSpan(entry)
+        for resource in ConferenceApi._bookingResources(entry):
+            booked = bookings.setdefault(resource, [])
+            booking = [start, end, entry['websafeKey'], end, entry['websafeKey']]
+            i = bisect.bisect(booked, booking)
+            if i and booked[i - 1][3] >= end:
+                booking[3:] = booked[i - 1][3:]
+            booked.insert(i, booking)
+            # latest ends never decrease, so stop at the first one past ours
+            for later in itertools.islice(booked, i + 1, None):
+                if later[3] >= booking[3]:
+                    break
+                later[3:] = booking[3:]
+
+    @staticmethod
+    def _findBookingConflict(bookings, entry):
+        """Return why entry would double-book its speaker or room, or None.
+        An earlier booking runs past the entry's start exactly when the
+        latest end before it does, even where schedules built from sessions
+        stored before this check hold overlapping intervals.  Bookings
+        starting from the entry's start are checked up to its end."""
+        start, end = ConferenceApi._bookingSpan(entry)
+        for resource in ConferenceApi._bookingResources(entry):
+            booked = bookings.get(resource, [])
+            i = bisect.bisect_left(booked, [start])
+            conflict = None
+            if i and booked[i - 1][3] > start:
+                conflict = booked[i - 1][4]
+            # only zero-length bookings at the entry's start don't overlap
+            while not conflict and i < len(booked) and booked[i][0] < end:
+                if start < booked[i][1]:
+                    conflict = booked[i][2]
+                i += 1
+            if conflict:
+                kind, name = resource.split(':', 1)
+                return "The %s '%s' is already booked at that time (session %s)" % (
+                    kind, name, conflict)
+        return None
+
+    @staticmethod
+    def _getSchedule(c_key):
+        """Return the schedule entries of a conference, sorted by date and time."""
+        schedule = ConferenceApi._scheduleKey(c_key).get()
+        if not schedule:
+            # only conferences get a schedule; read endpoints must not
+            # store one under any other key a client sends
+            if c_key.kind() != 'Conference' or not c_key.get():
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % c_key.urlsafe())
+            schedule = ConferenceApi._initSchedule(c_key)
+        return schedule.sessions or []
+
+    @staticmethod
+    @ndb.transactional
+    def _initSchedule(c_key):
+        """Build and store the schedule of a conference that predates
+        schedules."""
+        schedule = ConferenceApi._loadSchedule(c_key)
+        schedule.put()
+        return schedule
+
+    def _copyScheduleEntryToForm(self, entry):
+        """Copy a ConferenceSchedule entry to a SessionForm; description
+        is the entry's snippet."""
+        ses = SessionForm()
+        for field in ses.all_fields():
+            if field.name == 'sessionType':
+                setattr(ses, field.name, getattr(SessionType, entry[field.name]))
+            else:
+                setattr(ses, field.name, entry.get(field.name))
+        ses.check_initialized()
+        return ses
+
+    def _filterSchedule(self, entries, filters):
+        """Return the schedule entries matching every QueryForm filter;
+        any combination of fields and operators is allowed."""
+        filters = self._parseFilters(Session, filters, SESSIONFIELDS)
         for filtr in filters:
-            if filtr["field"] in ["duration", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            elif filtr["field"] == "date":
-                filtr["value"] = datetime.strptime(filtr["value"],"%Y-%m-%d")
-            elif filtr["field"] == "time":
-                # time stored in datastore with the 1970-01-01 date so need to adjust accordingly
-                filtr["value"] = datetime.strptime(filtr["value"],"%H:%M") + timedelta(days=70*365.25) - timedelta(hours=12)
-                logging.info("time=%s"%str(filtr["value"]))
-            formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
+            # schedule entries hold dates as ISO strings
+            if filtr["field"] == "date":
+                filtr["value"] = filtr["value"].isoformat()
+        return [entry for entry in entries
+                if self._matchesFilters(
+                    lambda field: self._scheduleValue(entry, field), filters)]
+
+    @staticmethod
+    def _scheduleValue(entry, field):
+        """Return a session field of a schedule entry, deriving the
+        minute-of-day fields from its time and duration."""
+        if field in MINUTEFIELDS:
+            start = int(entry['time'][:2]) * 60 + int(entry['time'][3:5])
+            if field == 'startMinute':
+                return start
+            return start + entry['duration'] if entry['duration'] is not None else None
+        return entry.get(field)
+
+    def _sessionFilters(self, request):
+        """Return the QueryForm filters of a session QueryForms, adding
+        filters for its time window: sessions that start and end between
+        windowStart and windowEnd (HH:MM) on any day.  The start filters
+        bound one startMinute index range; the end check is done in memory."""
+        filters = list(request.filters)
+        if request.windowStart:
+            filters.append(QueryForm(field='TIME', operator='GTEQ',
+                                     value=request.windowStart))
+        if request.windowEnd:
+            filters.append(QueryForm(field='TIME', operator='LTEQ',
+                                     value=request.windowEnd))
+            filters.append(QueryForm(field='END_TIME', operator='LTEQ',
+                                     value=request.windowEnd))
+        return filters
+
+    def _getSessionQuery(self, request):
+        """Return QueryPlan for the submitted session filters."""
+        return self._planQuery(Session, self._sessionFilters(request), SESSIONFIELDS,
+                               [Session.date, Session.time])
 
     @endpoints.method(QueryForms, SessionForms,
             path='querySessions',
@@ -622,24 +2045,40 @@ class ConferenceApi(remote.Service):
             name='querySessions')
     def querySessions(self, request):
         """Query for sessions."""
-        sessions = self._getSessionQuery(request)
+        sessions, next_token = self._runQueryPlan(self._getSessionQuery(request), request)
 
         # return individual SessionForm object per Session
         return SessionForms(
             items=[self._copySessionToForm(session) \
-            for session in sessions]
+            for session in sessions],
+            nextPageToken=next_token
         )
     
     @endpoints.method(SESSION_CREATE, SessionForm, path='conference/{websafeKey}/session',
             http_method='POST', name='createSession')
     def createSession(self, request):
         """Create new sessionn for given conference."""
+        if not request.speaker:
+            raise endpoints.BadRequestException("Session 'speaker' field required")
         # get Conference object from request; bail if not found
+        # the conference, the speaker and the new session id don't depend
+        # on each other, so request them all before waiting on any
         c_key = ndb.Key(urlsafe=request.websafeKey)
-        conf = c_key.get()
+        entities_future = ndb.get_multi_async([c_key, ndb.Key(Speaker, request.speaker)])
+        ids_future = Session.allocate_ids_async(size=1, parent=c_key)
+        conf, spkr = [future.get_result() for future in entities_future]
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeKey)
+        if not spkr:
+            raise endpoints.NotFoundException(
+                'No speaker found with key: %s' % request.speaker)
+        user = self._getConferenceOwner(conf)
+        s_id = ids_future.get_result()[0]
+        return self._createSessionObject(request,conf.key,s_id,spkr,user)
+
+    def _getConferenceOwner(self, conf):
+        """Return the current user, who must be the conference's organizer."""
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
@@ -647,7 +2086,54 @@ class ConferenceApi(remote.Service):
         owner = conf.key.parent().id()
         if owner != user_id:
             raise endpoints.UnauthorizedException("User (%s) is not the owner of the conference (%s)"%(user_id,owner))
-        return self._createSessionObject(request,conf.key,conf.name,user) 
+        return user
+
+    @endpoints.method(SESSIONS_CREATE, SessionResultForms,
+            path='conference/{websafeKey}/sessions',
+            http_method='POST', name='createSessions')
+    def createSessions(self, request):
+        """Create several sessions for given conference, reporting the
+        result for each."""
+        c_key = ndb.Key(urlsafe=request.websafeKey)
+        conf = c_key.get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeKey)
+        user = self._getConferenceOwner(conf)
+        if len(request.items) > MAX_CREATE_SESSIONS:
+            raise endpoints.BadRequestException(
+                "At most %d sessions can be created at once" % MAX_CREATE_SESSIONS)
+        return self._createSessionObjects(request.items, c_key, user)
+
+    @endpoints.method(GET_REQUEST, BookingConflictForms,
+            path='conference/{websafeKey}/conflicts',
+            http_method='GET', name='getBookingConflicts')
+    def getBookingConflicts(self, request):
+        """Return every pair of sessions of a conference that book the
+        same speaker or location at overlapping times."""
+        try:
+            c_key = ndb.Key(urlsafe=request.websafeKey)
+        except:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeKey)
+        # one pass over the schedule, already sorted by start, splits it
+        # into each speaker's and room's intervals; each is then swept once
+        entries = {}
+        for entry in self._getSchedule(c_key):
+            span = self._bookingSpan(entry)
+            for resource in self._bookingResources(entry):
+                entries.setdefault(resource, []).append((span, entry['websafeKey']))
+        conflicts = []
+        for resource in sorted(entries):
+            booked = sorted(entries[resource])
+            kind, name = resource.split(':', 1)
+            overlaps = self._findOverlaps([span for span, wssk in booked])
+            for i in sorted(overlaps):
+                conflicts.extend(
+                    BookingConflictForm(resource=kind, value=name,
+                                        sessions=[booked[i][1], booked[j][1]])
+                    for j in sorted(overlaps[i]) if i < j)
+        return BookingConflictForms(items=conflicts)
 
     @endpoints.method(SESSION_QUERY, SessionForms,
             path='queryConferenceSessions/{websafeKey}',
@@ -655,29 +2141,89 @@ class ConferenceApi(remote.Service):
             name='queryConferenceSessions')
     def queryConferenceSessions(self, request):
         """Query for conference sessions."""
-        sessions = self._getSessionQuery(request,ndb.Key(urlsafe=request.websafeKey))
+        # filter the conference schedule in memory, which also allows
+        # combinations of filters the datastore can't index
+        entries = self._filterSchedule(
+            self._getSchedule(ndb.Key(urlsafe=request.websafeKey)),
+            self._sessionFilters(request))
+        entries, next_token = self._listPage(entries, request)
 
         # return individual SessionForm object per Session
         return SessionForms(
-            items=[self._copySessionToForm(session) \
-            for session in sessions]
+            items=[self._copyScheduleEntryToForm(entry) for entry in entries],
+            nextPageToken=next_token
         )
         
-    @endpoints.method(GET_REQUEST, BooleanMessage,
-            path='wishlist/{websafeKey}',
-            http_method='GET', name='addSessionToWishlist')
-    def addSessionToWishlist(self, request):
-        """Add session to user wishlist."""
+    def _getWishlistProfileKey(self):
+        """Return the current user's Profile key, first moving any legacy
+        sessionKeysWishList into WishlistEntry children."""
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
-        try:
-            p_key = ndb.Key(Profile, getUserId(user))
-        except:
+        p_key = ndb.Key(Profile, getUserId(user))
+        prof = p_key.get()
+        if not prof:
             raise endpoints.NotFoundException('Registration required')
+        if prof.sessionKeysWishList:
+            self._migrateWishlist(p_key)
+        return p_key
+
+    @staticmethod
+    def _wishlistEntry(p_key, s_key):
+        """Return the WishlistEntry of a session for a profile."""
+        return WishlistEntry(id=s_key.urlsafe(), parent=p_key,
+                             session=s_key, conference=s_key.parent())
+
+    @staticmethod
+    @ndb.transactional
+    def _migrateWishlist(p_key):
+        """Move Profile.sessionKeysWishList into WishlistEntry children;
+        both live in the profile's entity group."""
         prof = p_key.get()
-        prof.sessionKeysWishList.append(request.websafeKey)
-        prof.put()
+        if not prof.sessionKeysWishList:
+            return
+        entries = {}
+        for wssk in prof.sessionKeysWishList:
+            try:
+                s_key = ndb.Key(urlsafe=wssk)
+            except:
+                continue
+            if s_key.kind() == 'Session':
+                entries[wssk] = ConferenceApi._wishlistEntry(p_key, s_key)
+        prof.sessionKeysWishList = []
+        ndb.put_multi([prof] + list(entries.values()))
+
+    def _getWishlistSessionKey(self, request):
+        """Return the Session key named by the request; bail if malformed."""
+        try:
+            s_key = ndb.Key(urlsafe=request.websafeKey)
+        except:
+            s_key = None
+        if not s_key or s_key.kind() != 'Session':
+            raise endpoints.NotFoundException(
+                'No session found with key: %s' % request.websafeKey)
+        return s_key
+
+    @endpoints.method(GET_REQUEST, BooleanMessage,
+            path='wishlist/{websafeKey}',
+            http_method='GET', name='addSessionToWishlist')
+    def addSessionToWishlist(self, request):
+        """Add session to user wishlist."""
+        s_key = self._getWishlistSessionKey(request)
+        p_key = self._getWishlistProfileKey()
+        # keyed by session, so adding a session twice is a no-op
+        self._wishlistEntry(p_key, s_key).put()
+
+        return BooleanMessage(data=True)
+
+    @endpoints.method(GET_REQUEST, BooleanMessage,
+            path='wishlist/{websafeKey}',
+            http_method='DELETE', name='removeSessionFromWishlist')
+    def removeSessionFromWishlist(self, request):
+        """Remove session from user wishlist."""
+        s_key = self._getWishlistSessionKey(request)
+        p_key = self._getWishlistProfileKey()
+        ndb.Key(WishlistEntry, s_key.urlsafe(), parent=p_key).delete()
 
         return BooleanMessage(data=True)
     
@@ -686,34 +2232,69 @@ class ConferenceApi(remote.Service):
             http_method='GET', name='getConferenceSessionsWishlist')
     def getConferenceSessionsWishlist(self, request):
         """Return sessions for requested conference that are on user's wishlist."""
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        try:
-            p_key = ndb.Key(Profile, getUserId(user))
-        except:
-            raise endpoints.NotFoundException('Registration required')
-        prof = p_key.get()
         # get Conference object from request; bail if not found
         try:
             c_key = ndb.Key(urlsafe=request.websafeKey)
         except:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeKey)
-        array_of_wskeys=getattr(prof,'sessionKeysWishList')
-        array_of_keys=[]
-        sessions=[]
-        if array_of_wskeys:
-            for wskey in array_of_wskeys:
-                if ndb.Key(urlsafe=wskey).parent() == c_key:
-                    array_of_keys.append(ndb.Key(urlsafe=wskey))
-            sessions = ndb.get_multi(array_of_keys)
+        p_key = self._getWishlistProfileKey()
+        # only this user's entries for this conference are read
+        # entries are keyed by session, so a keys-only query is enough
+        w_keys = WishlistEntry.query(ancestor=p_key).filter(
+            WishlistEntry.conference == c_key).fetch(keys_only=True)
+        sessions = [session for session in
+                    ndb.get_multi([ndb.Key(urlsafe=w_key.id()) for w_key in w_keys])
+                    if session]
 
         # return set of SessionForm objects for the Conference
         return SessionForms(items=[self._copySessionToForm(session)\
          for session in sessions]
         )
     
+    @staticmethod
+    def _findOverlaps(intervals):
+        """Return {index: [indexes overlapping it]} for (start, end)
+        intervals sorted by start, sweeping once with a heap of the ends
+        of the intervals still open."""
+        overlaps = dict((i, []) for i in range(len(intervals)))
+        open_ends = []
+        for i, (start, end) in enumerate(intervals):
+            # intervals ending when this one starts don't overlap it
+            while open_ends and open_ends[0][0] <= start:
+                heapq.heappop(open_ends)
+            for other_end, j in open_ends:
+                overlaps[i].append(j)
+                overlaps[j].append(i)
+            heapq.heappush(open_ends, (end, i))
+        return overlaps
+
+    @endpoints.method(message_types.VoidMessage, AgendaForms,
+            path='agenda',
+            http_method='GET', name='getMyAgenda')
+    def getMyAgenda(self, request):
+        """Return the sessions on user's wishlist sorted by start, each
+        with the sessions it overlaps."""
+        p_key = self._getWishlistProfileKey()
+        # entries are keyed by session, so a keys-only query is enough
+        w_keys = WishlistEntry.query(ancestor=p_key).fetch(keys_only=True)
+        sessions = sorted(
+            (session for session in
+             ndb.get_multi([ndb.Key(urlsafe=w_key.id()) for w_key in w_keys])
+             if session),
+            key=lambda session: (session.date, session.time))
+        intervals = []
+        for session in sessions:
+            start = datetime.combine(session.date, session.time)
+            intervals.append((start, start + timedelta(minutes=session.duration)))
+        overlaps = self._findOverlaps(intervals)
+
+        return AgendaForms(items=[
+            AgendaItemForm(session=self._copySessionToForm(session),
+                           conflicts=[sessions[j].key.urlsafe()
+                                      for j in sorted(overlaps[i])])
+            for i, session in enumerate(sessions)])
+
     @endpoints.method(GET_REQUEST, SessionForms,
             path='conference/{websafeKey}/getsessions',
             http_method='GET', name='getConferenceSessions')
@@ -725,11 +2306,13 @@ class ConferenceApi(remote.Service):
         except:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeKey)
-        sessions = Session.query(ancestor=c_key).fetch()
+        forms = cache.readThrough('sessions',
+            cache.versionedKey('sessions', c_key.urlsafe()),
+            lambda: protojson.encode_message(SessionForms(
+                items=[self._copyScheduleEntryToForm(entry)
+                       for entry in self._getSchedule(c_key)])))
         # return set of SessionForm objects for the Conference
-        return SessionForms(items=[self._copySessionToForm(session)\
-         for session in sessions]
-        )
+        return protojson.decode_message(SessionForms, forms)
     
     @endpoints.method(SESSION_GET_REQUEST_TYPE, SessionForms,
             path='confsessiontype/{websafeKey}/{sType}',
@@ -742,13 +2325,14 @@ class ConferenceApi(remote.Service):
         except:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeKey)
-        #getattr(SessionType, getattr(session, field.name)
-        s_q = Session.query(ancestor=c_key)
-        sessions=s_q.filter(Session.sessionType==request.sType).fetch()
+        forms = cache.readThrough('sessionsByType',
+            cache.versionedKey('sessionsByType', c_key.urlsafe(), request.sType),
+            lambda: protojson.encode_message(SessionForms(
+                items=[self._copyScheduleEntryToForm(entry)
+                       for entry in self._getSchedule(c_key)
+                       if entry['sessionType'] == request.sType])))
         # return set of SessionForm objects for the Conference
-        return SessionForms(items=[self._copySessionToForm(session)\
-         for session in sessions]
-        )
+        return protojson.decode_message(SessionForms, forms)
     
 # - - - Speaker objects - - - - - - - - - - - - - - - - -
     def _copySpeakerToForm(self, speaker):
@@ -776,8 +2360,10 @@ class ConferenceApi(remote.Service):
             http_method='GET', name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
         """ Get the featured speaker info for the specified conference from memcache """
-        c_key = ndb.Key(urlsafe=request.websafeKey)
-        fspeaker = memcache.get("featuredspeaker-%s"%request.websafeKey)
+        wsck = request.websafeKey
+        fspeaker = cache.readWithLease('featuredSpeaker',
+            MEMCACHE_FEATURED_SPEAKER_PREFIX + wsck,
+            lambda: self._findFeaturedSpeaker(wsck))
         return StringMessage(data=fspeaker)
                 
     @endpoints.method(GET_REQUEST, SessionForms,
@@ -795,11 +2381,7 @@ class ConferenceApi(remote.Service):
         if not speaker:
             raise endpoints.NotFoundException(
                 'No speaker found with key: %s' % request.websafeKey)
-        array_of_wskeys=getattr(speaker,'sessionKeys')
-        sessions=[]
-        if array_of_wskeys:
-            array_of_keys = [ndb.Key(urlsafe=wskey) for wskey in array_of_wskeys]
-            sessions = ndb.get_multi(array_of_keys)
+        sessions = ndb.get_multi(speaker.sessionKeys)
         # return set of SessionForm objects for the Conference
         return SessionForms(items=[self._copySessionToForm(session)\
          for session in sessions]
@@ -809,19 +2391,34 @@ class ConferenceApi(remote.Service):
     def _doSpeaker(self, request):
         """Get, create or update speaker"""
         s_key = ndb.Key(Speaker,request.mainEmail)
-        speaker = s_key.get()
-        # if speaker exists, process user-modifyable fields
-        if speaker:
-            for field in ('displayName', 'bio'):
-                if hasattr(request, field):
-                    val = getattr(request, field)
-                    if val:
-                        setattr(speaker, field, str(val))
-        else:
-            speaker = Speaker(key=s_key, displayName=request.displayName, mainEmail=request.mainEmail, bio=request.bio)
-            
-        # put the modified speaker to datastore
-        speaker.put()
+
+        # read and write the speaker in one transaction, so sessionKeys
+        # added by a concurrent createSession aren't overwritten
+        @ndb.transactional(xg=True)
+        def _update():
+            speaker = s_key.get()
+            old_name = speaker.displayName if speaker else None
+            # if speaker exists, process user-modifyable fields
+            if speaker:
+                for field in ('displayName', 'bio'):
+                    if hasattr(request, field):
+                        val = getattr(request, field)
+                        if val:
+                            setattr(speaker, field, str(val))
+            else:
+                speaker = Speaker(key=s_key, displayName=request.displayName, mainEmail=request.mainEmail, bio=request.bio)
+
+            # put the modified speaker to datastore, together with the
+            # directory if the speaker is new or renamed
+            if old_name == speaker.displayName:
+                speaker.put()
+            else:
+                self._putSpeakerWithDirectory(speaker, old_name)
+            return speaker, old_name
+
+        speaker, old_name = _update()
+        if old_name != speaker.displayName:
+            cache.bumpGeneration(SPEAKER_DIRECTORY_SCOPE)
 
         # return SpeakerForm
         return self._copySpeakerToForm(speaker)
@@ -833,12 +2430,151 @@ class ConferenceApi(remote.Service):
         """Return speaker info."""
         return self._doSpeaker(request)
  
-    @endpoints.method(message_types.VoidMessage, SpeakerList,
+    @endpoints.method(SPEAKERS_PAGE_REQUEST, SpeakerList,
             path='allspeakers', http_method='GET', name='getAllSpeaker')
     def getAllSpeakers(self, request):
-        """Return list of speakers."""
-        speakers=Speaker.query().order(Speaker.displayName)
-        return SpeakerList(items=[self._copySpeakerToMiniForm(speaker) for speaker in speakers])
+        """Return a page of speakers, sorted by name."""
+        page_size = self._pageSize(request)
+        speakers = cache.readThrough('speakers',
+            cache.versionedKey('speakers', SPEAKER_DIRECTORY_SCOPE,
+                               str(request.pageToken or 0), str(page_size)),
+            lambda: protojson.encode_message(self._getSpeakerPage(request)))
+        return protojson.decode_message(SpeakerList, speakers)
+
+    def _getSpeakerPage(self, request):
+        """Return the SpeakerList page selected by request from the
+        directory snapshot, reading only the chunks the page spans."""
+        page_size = self._pageSize(request)
+        offset = self._pageOffset(request)
+        entries, total = self._getSpeakerDirectoryRange(offset, page_size)
+        return SpeakerList(
+            items=[SpeakerMiniForm(displayName=name, mainEmail=email)
+                   for name, email in entries],
+            nextPageToken=str(offset + page_size) if offset + page_size < total else None)
+
+    @staticmethod
+    def _getSpeakerDirectory():
+        """Return the SpeakerDirectory index, merging in one projection
+        query over all speakers the first time."""
+        d_key = ndb.Key(SpeakerDirectory, SPEAKER_DIRECTORY_ID)
+        directory = d_key.get()
+        if directory and directory.seeded:
+            return directory
+        speakers = Speaker.query().order(Speaker.displayName).fetch(
+            projection=[Speaker.displayName, Speaker.mainEmail],
+            batch_size=1000)
+        queried = [[speaker.displayName, speaker.mainEmail] for speaker in speakers]
+
+        # the query is eventually consistent, so speakers written since
+        # the directory was created keep the entries those writes made
+        @ndb.transactional
+        def _seed():
+            directory = d_key.get()
+            if directory and directory.seeded:
+                return directory
+            old_keys = []
+            entries = []
+            touched = set()
+            if directory:
+                old_keys = [ndb.Key(SpeakerDirectoryChunk, chunk_id, parent=d_key)
+                            for first, size, chunk_id in directory.chunks]
+                for chunk in ndb.get_multi(old_keys):
+                    entries.extend(chunk.speakers if chunk else [])
+                touched = set(directory.touched)
+            entries = sorted(entries + [entry for entry in queried
+                                        if entry[1] not in touched])
+            pieces = [entries[i:i + SPEAKER_CHUNK_SIZE]
+                      for i in range(0, len(entries), SPEAKER_CHUNK_SIZE)] or [[]]
+            first, last = SpeakerDirectoryChunk.allocate_ids(size=len(pieces), parent=d_key)
+            chunks = [SpeakerDirectoryChunk(id=chunk_id, parent=d_key, speakers=piece)
+                      for chunk_id, piece in zip(range(first, last + 1), pieces)]
+            directory = SpeakerDirectory(key=d_key, seeded=True, touched=[], chunks=[
+                [piece[0] if piece else [], len(piece), chunk.key.id()]
+                for piece, chunk in zip(pieces, chunks)])
+            ndb.delete_multi(old_keys)
+            ndb.put_multi(chunks + [directory])
+            return directory
+        return _seed()
+
+    @staticmethod
+    def _getSpeakerDirectoryRange(offset, limit):
+        """Return (up to limit directory entries from offset, the number
+        of entries in the directory)."""
+        directory = ConferenceApi._getSpeakerDirectory()
+        keys = []
+        skip = None
+        start = 0
+        for first, size, chunk_id in directory.chunks:
+            if start + size > offset and start < offset + limit:
+                if skip is None:
+                    skip = offset - start
+                keys.append(ndb.Key(SpeakerDirectoryChunk, chunk_id,
+                                    parent=directory.key))
+            start += size
+        entries = []
+        for chunk in ndb.get_multi(keys):
+            entries.extend(chunk.speakers if chunk else [])
+        skip = skip or 0
+        return entries[skip:skip + limit], start
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _putSpeakerWithDirectory(speaker, old_name):
+        """Store a new or renamed speaker and move its directory entry.
+        The chunks are children of the index, so this transaction spans
+        two entity groups however many chunks it writes.  Without a
+        directory yet, an empty one is created for the first read to merge
+        its query into, so this speaker can't be missed."""
+        d_key = ndb.Key(SpeakerDirectory, SPEAKER_DIRECTORY_ID)
+        directory = d_key.get()
+        loaded = {}
+        if not directory:
+            chunk_id = SpeakerDirectoryChunk.allocate_ids(size=1, parent=d_key)[0]
+            loaded[chunk_id] = SpeakerDirectoryChunk(id=chunk_id, parent=d_key, speakers=[])
+            directory = SpeakerDirectory(key=d_key, seeded=False,
+                                         chunks=[[[], 0, chunk_id]])
+        if not directory.seeded and speaker.mainEmail not in directory.touched:
+            directory.touched.append(speaker.mainEmail)
+        index = directory.chunks
+
+        def _chunkOf(entry):
+            """Return the index position of the chunk entry belongs in,
+            and that chunk."""
+            i = bisect.bisect_right([c[0] for c in index], entry, 1) - 1
+            if index[i][2] not in loaded:
+                loaded[index[i][2]] = ndb.Key(SpeakerDirectoryChunk, index[i][2],
+                    parent=directory.key).get()
+            return i, loaded[index[i][2]]
+
+        if old_name is not None:
+            old = [old_name, speaker.mainEmail]
+            i, chunk = _chunkOf(old)
+            j = bisect.bisect_left(chunk.speakers, old)
+            if j < len(chunk.speakers) and chunk.speakers[j] == old:
+                del chunk.speakers[j]
+                index[i][1] -= 1
+                if chunk.speakers:
+                    index[i][0] = chunk.speakers[0]
+                elif len(index) > 1:
+                    del loaded[index[i][2]]
+                    chunk.key.delete()
+                    del index[i]
+
+        new = [speaker.displayName, speaker.mainEmail]
+        i, chunk = _chunkOf(new)
+        bisect.insort(chunk.speakers, new)
+        index[i][0:2] = [chunk.speakers[0], index[i][1] + 1]
+        if len(chunk.speakers) > SPEAKER_CHUNK_SIZE:
+            half = len(chunk.speakers) // 2
+            upper = SpeakerDirectoryChunk(parent=directory.key,
+                id=SpeakerDirectoryChunk.allocate_ids(size=1, parent=directory.key)[0],
+                speakers=chunk.speakers[half:])
+            chunk.speakers = chunk.speakers[:half]
+            index[i][1] = half
+            index.insert(i + 1, [upper.speakers[0], len(upper.speakers), upper.key.id()])
+            loaded[upper.key.id()] = upper
+        ndb.put_multi(list(loaded.values()) + [directory])
+        speaker.put()
 
     @endpoints.method(SpeakerForm, SpeakerForm,
             path='addSpeaker', http_method='POST', name='addSpeaker')
@@ -911,6 +2647,8 @@ class ConferenceApi(remote.Service):
             # TODO 4
             # put the modified profile to datastore
             prof.put()
+            # conference lists cache the organizer's display name
+            memcache.delete(MEMCACHE_ORGANIZER_PREFIX + prof.key.urlsafe())
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
@@ -929,5 +2667,21 @@ class ConferenceApi(remote.Service):
         """Update & return user profile."""
         return self._doProfile(request)
     
+# background jobs, started by visiting /tasks/map?name=<name> as an admin;
+# the *_keys mappers store websafe key strings as compact keys
+mapper.register('session_minutes', Session.query)
+mapper.register('profile_keys', Profile.query)
+mapper.register('speaker_keys', Speaker.query)
+
+mapper.register('conference_facets', Conference.query,
+                lambda conf: ConferenceApi._countFacets([conf.key]),
+                transactional=False)
+mapper.register('search_conferences', Conference.query,
+                lambda conf: ConferenceApi._indexConferences([conf]),
+                transactional=False)
+mapper.register('search_sessions', Session.query,
+                lambda session: ConferenceApi._indexSessions([session]),
+                transactional=False)
+
 # registers API
-api = endpoints.api_server([ConferenceApi]) 
+api = instrument.middleware(endpoints.api_server([ConferenceApi])) 
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+"""instrument.py
+
+Per-request performance records for the API and the task handlers.
+
+middleware() wraps a WSGI app and records, for every request, its wall
+time and the datastore, memcache and task queue work it caused, counted by
+an API proxy hook.  Each record is logged as one JSON line and added to
+per-endpoint histograms kept in memcache in WINDOW second windows, of which
+getHistograms() sums the last WINDOWS.
+
+"""
+
+import json
+import logging
+import threading
+
+from time import time as unixtime
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+PERF_PREFIX = "perf-"
+SPI_PREFIX = "/_ah/spi/"
+
+# seconds per histogram window, and windows summed by getHistograms
+WINDOW = 300
+WINDOWS = 12
+# upper bounds in milliseconds of the latency buckets; one more bucket
+# counts slower requests
+BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# seconds between flushes of this instance's records to memcache
+FLUSH_INTERVAL = 10
+# attempts to merge a flush into the shared windows before dropping it
+FLUSH_ATTEMPTS = 3
+
+COUNTERS = ('datastoreGets', 'datastorePuts', 'datastoreDeletes',
+            'datastoreQueries', 'entities', 'memcacheHits', 'memcacheMisses',
+            'taskqueueAdds')
+
+_current = threading.local()
+_pending = {}
+_pending_lock = threading.Lock()
+_last_flush = [unixtime()]
+
+
+def _countRpc(service, call, request, response):
+    """API proxy post-call hook adding a finished RPC to the current
+    request's counters."""
+    stats = getattr(_current, 'stats', None)
+    if stats is None:
+        return
+    if service == 'datastore_v3':
+        if call == 'Get':
+            stats['datastoreGets'] += request.key_size()
+            stats['entities'] += sum(1 for result in response.entity_list()
+                                     if result.has_entity())
+        elif call == 'Put':
+            stats['datastorePuts'] += request.entity_size()
+        elif call == 'Delete':
+            stats['datastoreDeletes'] += request.key_size()
+        elif call == 'RunQuery':
+            stats['datastoreQueries'] += 1
+            stats['entities'] += response.result_size()
+        elif call == 'Next':
+            stats['entities'] += response.result_size()
+    elif service == 'memcache' and call == 'Get':
+        hits = response.item_size()
+        stats['memcacheHits'] += hits
+        stats['memcacheMisses'] += request.key_size() - hits
+    elif service == 'taskqueue' and call == 'BulkAdd':
+        stats['taskqueueAdds'] += request.add_request_size()
+
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('instrument', _countRpc)
+
+
+def _requestName(environ):
+    """Return the endpoint name of a request: 'ConferenceApi.<method>' for
+    the API, else the path."""
+    path = environ.get('PATH_INFO', '')
+    if path.startswith(SPI_PREFIX):
+        return path[len(SPI_PREFIX):]
+    return path
+
+
+def middleware(app):
+    """Return app recording the performance of every request."""
+    def instrumentedApp(environ, start_response):
+        stats = dict.fromkeys(COUNTERS, 0)
+        _current.stats = stats
+        start = unixtime()
+        try:
+            return app(environ, start_response)
+        finally:
+            _current.stats = None
+            stats['ms'] = int((unixtime() - start) * 1000)
+            record(_requestName(environ), stats)
+    return instrumentedApp
+
+
+def record(name, stats):
+    """Log a request's stats and add them to this instance's pending
+    histogram counts, flushing those every FLUSH_INTERVAL seconds."""
+    logging.info('perf %s', json.dumps(dict(stats, endpoint=name), sort_keys=True))
+    with _pending_lock:
+        _merge(_pending.setdefault(name, _emptyWindow()), _windowOf(stats))
+        if unixtime() - _last_flush[0] < FLUSH_INTERVAL:
+            return
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush[0] = unixtime()
+    _flush(pending)
+
+
+def _emptyWindow():
+    window = dict.fromkeys(COUNTERS + ('calls', 'ms'), 0)
+    window['buckets'] = [0] * (len(BUCKETS_MS) + 1)
+    return window
+
+
+def _windowOf(stats):
+    """Return the histogram window counts of a single request."""
+    window = dict(stats, calls=1)
+    window['buckets'] = [0] * (len(BUCKETS_MS) + 1)
+    window['buckets'][_bucket(stats['ms'])] = 1
+    return window
+
+
+def _bucket(ms):
+    for i, bound in enumerate(BUCKETS_MS):
+        if ms <= bound:
+            return i
+    return len(BUCKETS_MS)
+
+
+def _merge(window, other):
+    """Add the counts of window other to window."""
+    for field in COUNTERS + ('calls', 'ms'):
+        window[field] += other.get(field, 0)
+    window['buckets'] = [a + b for a, b in zip(window['buckets'], other['buckets'])]
+    return window
+
+
+def _windowKey(window, name):
+    return '%s%d-%s' % (PERF_PREFIX, window, name)
+
+
+def _flush(pending):
+    """Merge pending {name: window counts} into the current shared windows
+    with compare-and-set, so that concurrent instances don't lose counts."""
+    window = int(unixtime()) // WINDOW
+    names = dict((_windowKey(window, name), name) for name in pending)
+    client = memcache.Client()
+    for attempt in range(FLUSH_ATTEMPTS):
+        current = client.get_multi(list(names), for_cas=True)
+        merged = dict((key, _merge(current.get(key) or _emptyWindow(),
+                                   pending[names[key]]))
+                      for key in names)
+        failed = []
+        existing = dict((key, merged[key]) for key in merged if key in current)
+        if existing:
+            failed += client.cas_multi(existing, time=WINDOW * (WINDOWS + 1))
+        new = dict((key, merged[key]) for key in merged if key not in current)
+        if new:
+            failed += client.add_multi(new, time=WINDOW * (WINDOWS + 1))
+        if not failed:
+            return
+        names = dict((key, names[key]) for key in failed)
+    logging.warning('Dropped performance counts of %s',
+                    ', '.join(sorted(names.values())))
+
+
+def getHistograms(names):
+    """Return {name: window counts} of the given endpoint names summed over
+    the last WINDOWS windows, for names that had requests."""
+    window = int(unixtime()) // WINDOW
+    keys = [(_windowKey(w, name), name) for name in names
+            for w in range(window - WINDOWS + 1, window + 1)]
+    windows = memcache.get_multi([key for key, name in keys])
+    histograms = {}
+    for key, name in keys:
+        if key in windows:
+            _merge(histograms.setdefault(name, _emptyWindow()), windows[key])
+    return histograms
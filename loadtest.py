@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+"""loadtest.py
+
+Concurrent session registration load test, run against dev_appserver or a
+deployed version of the API.
+
+It creates a speaker, a conference and one session with --seats seats.
+Then every client, one per OAuth access token in --tokens, calls
+registerForSession at the same moment.  Everyone seated unregisters
+between rounds, and this repeats for --rounds rounds.  A user holds at
+most one seat, so each token must belong to a different Google account.
+The API only accepts tokens with the email scope issued to one of its
+allowed client ids, and dev_appserver checks them with Google, so it needs
+network access.
+
+There must be more clients than seats, so that overselling can show.
+The test fails if a round seats more clients than the session has seats,
+or fewer than it has.  It also fails if the session's seatsAvailable,
+read back once the seat sync task has run, differs from the seats left
+after the round, if any request errors, or if registrations per second
+fall below --min-rate.
+
+    python loadtest.py --tokens tokens.txt --seats 50 --rounds 5
+
+"""
+
+import argparse
+import json
+import sys
+import threading
+import uuid
+
+from time import sleep
+from time import time as unixtime
+
+try:
+    from urllib2 import HTTPError, Request, urlopen
+except ImportError:
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+
+API_PATH = '/_ah/api/conference/v1/'
+
+
+class Client(object):
+    """Calls the conference API as the user of one access token."""
+
+    def __init__(self, base_url, token):
+        self.base_url = base_url.rstrip('/') + API_PATH
+        self.token = token
+
+    def call(self, method, path, body=None):
+        """Return (HTTP status, decoded JSON response) of an API call."""
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = Request(self.base_url + path, data=data, headers={
+            'Authorization': 'Bearer %s' % self.token,
+            'Content-Type': 'application/json'})
+        request.get_method = lambda: method
+        try:
+            response = urlopen(request)
+        except HTTPError as e:
+            response = e
+        content = response.read()
+        return response.getcode(), json.loads(content.decode('utf-8') or '{}')
+
+    def check(self, method, path, body=None):
+        """Return the response of an API call that must succeed."""
+        status, result = self.call(method, path, body)
+        if status != 200:
+            raise RuntimeError('%s %s failed with %d: %s' % (method, path, status, result))
+        return result
+
+
+def createSession(organizer, seats):
+    """Create a conference with one session of seats seats as organizer;
+    returns the websafeKeys of the conference and of the session."""
+    run = uuid.uuid4().hex[:8]
+    email = 'loadtest-%s@example.com' % run
+    organizer.check('POST', 'addSpeaker', {'displayName': 'Load test %s' % run,
+                                           'mainEmail': email})
+    name = 'Load test %s' % run
+    organizer.check('POST', 'conference', {'name': name, 'city': 'Load test',
+                                           'startDate': '2030-01-01',
+                                           'endDate': '2030-01-02'})
+    conferences = organizer.check('POST', 'getConferencesCreated').get('items', [])
+    wsck = [conf['websafeKey'] for conf in conferences if conf['name'] == name][0]
+    organizer.check('POST', 'conference/%s/session' % wsck, {
+        'name': 'Keynote', 'speaker': email, 'date': '2030-01-01',
+        'time': '09:00', 'duration': 60, 'location': 'Main hall',
+        'maxAttendees': seats})
+    sessions = organizer.check('GET', 'conference/%s/getsessions' % wsck).get('items', [])
+    return wsck, sessions[0]['websafeKey']
+
+
+def waitForSeats(client, wsck, wssk, expected, timeout):
+    """Return the session's seatsAvailable once it equals expected, or the
+    last value read when timeout seconds have passed."""
+    deadline = unixtime() + timeout
+    while True:
+        sessions = client.check('GET', 'conference/%s/getsessions' % wsck).get('items', [])
+        seats = [int(session.get('seatsAvailable') or 0) for session in sessions
+                 if session['websafeKey'] == wssk][0]
+        if seats == expected or unixtime() >= deadline:
+            return seats
+        sleep(1)
+
+
+def runAll(clients, method, path):
+    """Make the same call from every client at once; returns the
+    (status, result, seconds) of each client's call and the wall time."""
+    outcomes = [None] * len(clients)
+    start = threading.Event()
+
+    def worker(i, client):
+        start.wait()
+        began = unixtime()
+        try:
+            status, result = client.call(method, path)
+        except Exception as e:
+            status, result = None, str(e)
+        outcomes[i] = (status, result, unixtime() - began)
+
+    threads = [threading.Thread(target=worker, args=(i, client))
+               for i, client in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    began = unixtime()
+    start.set()
+    for thread in threads:
+        thread.join()
+    return outcomes, unixtime() - began
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--url', default='http://localhost:8080',
+                        help='base URL of the app (default: %(default)s)')
+    parser.add_argument('--tokens', required=True,
+                        help='file of OAuth access tokens, one per line and '
+                             'per account; the first one organizes')
+    parser.add_argument('--seats', type=int, default=20,
+                        help='seats of the session (default: %(default)s)')
+    parser.add_argument('--rounds', type=int, default=3,
+                        help='registration rounds (default: %(default)s)')
+    parser.add_argument('--sync-timeout', type=float, default=60.0,
+                        help='seconds to wait for seatsAvailable to catch up '
+                             'after a round (default: %(default)s)')
+    parser.add_argument('--min-rate', type=float, default=10.0,
+                        help='least acceptable registration requests per '
+                             'second (default: %(default)s)')
+    args = parser.parse_args()
+    if args.rounds < 1:
+        parser.error('--rounds must be at least 1')
+
+    with open(args.tokens) as f:
+        tokens = [line.strip() for line in f if line.strip()]
+    if len(tokens) <= args.seats:
+        parser.error('%s has %d tokens; overselling only shows with more '
+                     'clients than --seats (%d)' % (args.tokens, len(tokens), args.seats))
+    clients = [Client(args.url, token) for token in tokens]
+    wsck, wssk = createSession(clients[0], args.seats)
+    print('session %s: %d seats, %d clients' % (wssk, args.seats, len(clients)))
+
+    failures = []
+    latencies = []
+    requests = 0
+    elapsed = 0.0
+    for round_number in range(1, args.rounds + 1):
+        outcomes, seconds = runAll(clients, 'POST', 'session/%s/register' % wssk)
+        seated = [i for i, (status, result, t) in enumerate(outcomes)
+                  if status == 200 and result.get('data')]
+        rejected = sum(1 for status, result, t in outcomes if status == 409)
+        errors = [(status, result) for status, result, t in outcomes
+                  if status not in (200, 409)]
+        latencies.extend(t for status, result, t in outcomes)
+        requests += len(outcomes)
+        elapsed += seconds
+        print('round %d: %d seated, %d turned away, %d errors in %.2fs' % (
+            round_number, len(seated), rejected, len(errors), seconds))
+        if len(seated) > args.seats:
+            failures.append('round %d oversold: %d seated for %d seats'
+                            % (round_number, len(seated), args.seats))
+        elif len(seated) < args.seats:
+            failures.append('round %d seated %d, expected %d'
+                            % (round_number, len(seated), args.seats))
+        # the shard total reaches Session.seatsAvailable through the seat
+        # sync task
+        left = waitForSeats(clients[0], wsck, wssk, args.seats - len(seated),
+                            args.sync_timeout)
+        if left != args.seats - len(seated):
+            failures.append('round %d: seatsAvailable is %d after seating %d of %d'
+                            % (round_number, left, len(seated), args.seats))
+        failures.extend('round %d error %s: %s' % ((round_number,) + error)
+                        for error in errors[:5])
+
+        # free the seats for the next round
+        leaving = [clients[i] for i in seated]
+        outcomes, seconds = runAll(leaving, 'POST', 'session/%s/unregister' % wssk)
+        failures.extend('round %d unregister failed with %s: %s'
+                        % (round_number, status, result)
+                        for status, result, t in outcomes if status != 200)
+
+    rate = requests / elapsed if elapsed else 0.0
+    print('%d registrations at %.1f per second; latency p50 %.0fms, '
+          'p95 %.0fms, max %.0fms' % (
+              requests, rate, percentile(latencies, 0.5) * 1000,
+              percentile(latencies, 0.95) * 1000, max(latencies) * 1000))
+    if rate < args.min_rate:
+        failures.append('throughput %.1f/s is below %.1f/s' % (rate, args.min_rate))
+    for failure in failures:
+        print('FAIL: %s' % failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
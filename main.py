@@ -1,8 +1,18 @@
 #!/usr/bin/env python
+import json
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.api import taskqueue
+from google.appengine.ext import blobstore
+from google.appengine.ext import ndb
+from google.appengine.ext.webapp import blobstore_handlers
+from conference import CACHE_NAMES
 from conference import ConferenceApi
+import cache
+import instrument
+import mapper
+from models import ConferenceImport
 from google.appengine.api import app_identity
 from google.appengine.api import mail
 
@@ -31,8 +41,116 @@ class CacheFeaturedSpeaker(webapp2.RequestHandler):
         """Cache a featured speaker and sessions for a conference"""
         ConferenceApi()._cacheFeaturedSpeaker(self.request.get('conference'),self.request.get('speaker'))
         
-app = webapp2.WSGIApplication([
+class SyncSeatsAvailable(webapp2.RequestHandler):
+    def post(self):
+        """Copy a conference's or session's seat shard total onto it"""
+        ConferenceApi._syncSeatsAvailable(self.request.get('websafeKey'))
+
+class CountFacets(webapp2.RequestHandler):
+    def post(self):
+        """Bring the facet counts of conferences up to date"""
+        ConferenceApi._countFacets([ndb.Key(urlsafe=wsck) for wsck in
+                                    self.request.get_all('websafeKey')])
+
+class RunMapper(webapp2.RequestHandler):
+    def get(self):
+        """Start mapper ?name= over all its entities"""
+        mapper.start(self.request.get('name'))
+
+    def post(self):
+        """Map one batch and queue the next"""
+        mapper.runBatch(self.request.get('name'), self.request.get('run'),
+                        int(self.request.get('batch')),
+                        self.request.get('cursor'))
+
+class ImportConferencesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Show the upload form, or the progress of import ?id=, queueing
+        it again from its last checkpoint if &resume=1"""
+        import_id = self.request.get('id')
+        if not import_id:
+            self.response.write(
+                '<form action="%s" method="POST" enctype="multipart/form-data">'
+                '<input type="file" name="file"> '
+                '<select name="format"><option>csv</option><option>json</option></select> '
+                '<input type="submit" value="Import conferences"></form>'
+                % blobstore.create_upload_url('/admin/import_conferences/upload'))
+            return
+        job = ndb.Key(ConferenceImport, int(import_id)).get()
+        if not job:
+            self.abort(404)
+        if self.request.get('resume') and not job.done:
+            taskqueue.add(params={'id': job.key.id(), 'offset': job.offset},
+                url='/tasks/import_conferences')
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({
+            'id': job.key.id(), 'done': job.done, 'imported': job.imported,
+            'lines': job.lineNumber, 'errors': job.errors}))
+
+class ImportConferencesUploadHandler(blobstore_handlers.BlobstoreUploadHandler):
+    def post(self):
+        """Start importing an uploaded CSV (header row; topics separated
+        by ';') or JSON-lines file of conferences"""
+        uploads = self.get_uploads('file')
+        if not uploads:
+            self.abort(400)
+        job = ConferenceImport(blobKey=uploads[0].key(),
+            fileFormat='json' if self.request.get('format') == 'json' else 'csv')
+        job.put()
+        taskqueue.add(params={'id': job.key.id(), 'offset': 0},
+            url='/tasks/import_conferences')
+        self.redirect('/admin/import_conferences?id=%d' % job.key.id())
+
+class ImportConferences(webapp2.RequestHandler):
+    def post(self):
+        """Import the next batch of a conference upload"""
+        ConferenceApi()._importConferences(int(self.request.get('id')),
+                                           int(self.request.get('offset')))
+
+class PerformanceHandler(webapp2.RequestHandler):
+    def get(self):
+        """Show latency histograms and average datastore, memcache and
+        task queue work per endpoint over the last hour, as JSON"""
+        names = ['ConferenceApi.%s' % name
+                 for name in ConferenceApi.all_remote_methods()] + \
+                [path for path, handler in ROUTES]
+        report = {}
+        for name, window in instrument.getHistograms(names).items():
+            calls = window['calls']
+            report[name] = dict(
+                calls=calls,
+                histogramMs=[['<=%d' % bound, count] for bound, count in
+                             zip(instrument.BUCKETS_MS, window['buckets'])] +
+                            [['>%d' % instrument.BUCKETS_MS[-1], window['buckets'][-1]]],
+                average=dict((field, float(window[field]) / calls)
+                             for field in instrument.COUNTERS + ('ms',)))
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(report, indent=2, sort_keys=True))
+
+class CacheStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Show hit and miss counts of the read-through caches, and the
+        local tier entries evicted for space, as JSON"""
+        report = dict((name, dict(hits=hits, misses=misses, localHits=localHits,
+                                  localMisses=localMisses))
+                      for name, hits, misses, localHits, localMisses
+                      in cache.getStats(CACHE_NAMES))
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(dict(caches=report,
+            localEvictions=cache.getLocalEvictions()), indent=2, sort_keys=True))
+
+ROUTES = [
     ('/crons/set_announcement', SetAnnouncementHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
     ('/tasks/featuredSpeaker', CacheFeaturedSpeaker),
-], debug=True)
+    ('/tasks/sync_seats', SyncSeatsAvailable),
+    ('/tasks/count_facets', CountFacets),
+    ('/tasks/map', RunMapper),
+    ('/tasks/import_conferences', ImportConferences),
+    ('/admin/import_conferences', ImportConferencesHandler),
+    ('/admin/import_conferences/upload', ImportConferencesUploadHandler),
+    ('/admin/perf', PerformanceHandler),
+    ('/admin/cache_stats', CacheStatsHandler),
+]
+
+app = instrument.middleware(webapp2.WSGIApplication(ROUTES, debug=True))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""mapper.py
+
+Cursor-driven batch jobs over every entity matched by a query.
+
+Each batch runs in its own task and queues the next one with the query
+cursor, so backfills and storage migrations proceed while the app keeps
+serving.  Entities are re-read and written in a transaction one by one,
+so a concurrent write is never overwritten with stale data.
+
+"""
+
+import logging
+
+from time import time as unixtime
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+MAPPER_URL = '/tasks/map'
+BATCH_SIZE = 100
+
+_mappers = {}
+
+
+def register(name, query, fn=None, batch_size=BATCH_SIZE, transactional=True):
+    """Register mapper name over query, a callable returning an ndb query.
+    fn(entity) changes the entity in place and returns True if it must be
+    written back; without fn every entity is re-put as is, which stores
+    computed properties and converts properties to their current format.
+    fn must be idempotent, as a batch may run more than once.  Mappers
+    whose fn writes other entity groups and never changes the entity
+    itself must not be transactional."""
+    _mappers[name] = (query, fn, batch_size, transactional)
+
+
+def start(name):
+    """Queue the first batch of mapper name."""
+    if name not in _mappers:
+        raise KeyError('No mapper named %s' % name)
+    _queueBatch(name, str(int(unixtime())), 0, None)
+
+
+def _queueBatch(name, run, batch, urlsafeCursor):
+    """Queue one batch; task names make a retried batch queue its
+    successor only once."""
+    params = {'name': name, 'run': run, 'batch': batch}
+    if urlsafeCursor:
+        params['cursor'] = urlsafeCursor
+    try:
+        taskqueue.add(url=MAPPER_URL, params=params,
+                      name='map-%s-%s-%d' % (name, run, batch))
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+@ndb.tasklet
+def _mapEntity(key, fn):
+    entity = yield key.get_async()
+    if entity and (fn is None or fn(entity)):
+        yield entity.put_async()
+
+
+def runBatch(name, run, batch, urlsafeCursor=None):
+    """Map one batch of mapper name, then queue the next."""
+    query, fn, batch_size, transactional = _mappers[name]
+    cursor = Cursor(urlsafe=urlsafeCursor) if urlsafeCursor else None
+    keys, next_cursor, more = query().fetch_page(
+        batch_size, start_cursor=cursor, keys_only=True)
+    if transactional:
+        futures = [ndb.transaction_async(lambda key=key: _mapEntity(key, fn))
+                   for key in keys]
+    else:
+        futures = [_mapEntity(key, fn) for key in keys]
+    ndb.Future.wait_all(futures)
+    for future in futures:
+        future.check_success()
+    if more and next_cursor:
+        _queueBatch(name, run, batch + 1, next_cursor.urlsafe())
+    else:
+        logging.info('Mapper %s run %s finished after %d batches',
+                     name, run, batch + 1)
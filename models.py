@@ -43,6 +43,29 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    seatShards      = ndb.IntegerProperty(default=0, indexed=False)
+
+class SeatShard(ndb.Model):
+    """SeatShard -- one slice of a conference's or session's available seats.
+    Key id is '<conference/session websafeKey>:<n>'; no parent, so each
+    shard is its own entity group and registrations spread across them.
+    """
+    conference      = ndb.KeyProperty(kind='Conference')
+    session         = ndb.KeyProperty(kind='Session')
+    seats           = ndb.IntegerProperty(default=0, indexed=False)
+
+class ConferenceImport(ndb.Model):
+    """ConferenceImport -- progress of a bulk conference import; the
+    offset and line number checkpoint how far the upload has been read"""
+    blobKey         = ndb.BlobKeyProperty(required=True)
+    fileFormat      = ndb.StringProperty(choices=['csv', 'json'], required=True)
+    columns         = ndb.StringProperty(repeated=True, indexed=False)
+    offset          = ndb.IntegerProperty(default=0, indexed=False)
+    lineNumber      = ndb.IntegerProperty(default=0, indexed=False)
+    imported        = ndb.IntegerProperty(default=0, indexed=False)
+    errors          = ndb.StringProperty(repeated=True, indexed=False)
+    done            = ndb.BooleanProperty(default=False)
+    created         = ndb.DateTimeProperty(auto_now_add=True)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -62,6 +85,21 @@ class ConferenceForm(messages.Message):
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+class ConferenceKeysForm(messages.Message):
+    """ConferenceKeysForm -- inbound list of conference websafe keys"""
+    websafeKeys = messages.StringField(1, repeated=True)
+
+class RegistrationResultForm(messages.Message):
+    """RegistrationResultForm -- outcome of registering for one conference"""
+    websafeKey = messages.StringField(1)
+    registered = messages.BooleanField(2)
+    error = messages.StringField(3)
+
+class RegistrationResultForms(messages.Message):
+    """RegistrationResultForms -- multiple RegistrationResultForm outbound form message"""
+    items = messages.MessageField(RegistrationResultForm, 1, repeated=True)
 
 class QueryForm(messages.Message):
     """QueryForm -- query inbound form message"""
@@ -72,13 +110,26 @@ class QueryForm(messages.Message):
 class QueryForms(messages.Message):
     """QueryForms -- multiple QueryForm inbound form message"""
     filters = messages.MessageField(QueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+    windowStart = messages.StringField(4)
+    windowEnd = messages.StringField(5)
+
+class UrlsafeKeyProperty(ndb.KeyProperty):
+    """KeyProperty that also reads values stored as websafe key strings,
+    so a StringProperty of websafe keys can be converted in place: every
+    put stores the compact key, and mapper.py rewrites the rest."""
+    def _db_get_value(self, v, unused_p):
+        if v.has_stringvalue():
+            return ndb.Key(urlsafe=v.stringvalue())
+        return super(UrlsafeKeyProperty, self)._db_get_value(v, unused_p)
 
 class Speaker(ndb.Model):
     """Speaker -- Speaker profile object"""
     displayName = ndb.StringProperty(required=True)
     mainEmail = ndb.StringProperty(required=True)
     bio = ndb.TextProperty()
-    sessionKeys = ndb.StringProperty(repeated=True)
+    sessionKeys = UrlsafeKeyProperty(kind='Session', repeated=True)
 
 class SpeakerForm(messages.Message):
     """SpeakerForm -- Speaker outbound form message"""
@@ -93,6 +144,54 @@ class SpeakerMiniForm(messages.Message):
 
 class SpeakerList(messages.Message):
     items = messages.MessageField(SpeakerMiniForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+class SearchPosting(ndb.Model):
+    """SearchPosting -- one document in the posting list of a search term
+    ('<kind>:<token>'); key id is '<term>|<document websafeKey>'"""
+    term            = ndb.StringProperty(required=True)
+    doc             = ndb.KeyProperty(indexed=False)
+    # indexed so a posting list is read best first
+    weight          = ndb.IntegerProperty()
+
+class FacetCounts(ndb.Model):
+    """FacetCounts -- {facet: {value: count}} of one shard of the
+    conferences in a scope; key id is '<scope>#<shard>', where scope is
+    'all', or '<facet>:<value>' for the conferences having that facet value"""
+    counts          = ndb.JsonProperty()
+    updated         = ndb.DateTimeProperty(auto_now=True)
+
+class CountedFacets(ndb.Model):
+    """CountedFacets -- {scope: [[facet, value]]} a conference is counted
+    under in the FacetCounts of each scope; key id 1, parent=conference"""
+    scopes          = ndb.JsonProperty()
+
+class FacetCountForm(messages.Message):
+    """FacetCountForm -- number of conferences with one facet value"""
+    facet = messages.StringField(1)
+    value = messages.StringField(2)
+    count = messages.IntegerField(3)
+
+class FacetCountForms(messages.Message):
+    """FacetCountForms -- multiple FacetCountForm outbound form message"""
+    items = messages.MessageField(FacetCountForm, 1, repeated=True)
+
+class SpeakerDirectory(ndb.Model):
+    """SpeakerDirectory -- index of the speaker directory, the sorted
+    [displayName, mainEmail] of every speaker split into name ranges:
+    [[first entry, size, chunk id]] of its SpeakerDirectoryChunks in order.
+    A single entity (id 'index') kept up to date by the speaker endpoints
+    so the directory is paged without querying speakers.  Until the
+    snapshot query has been merged in (seeded), touched lists the emails
+    of speakers already written to it, whose entries win over the query's"""
+    chunks          = ndb.JsonProperty()
+    seeded          = ndb.BooleanProperty(default=True, indexed=False)
+    touched         = ndb.StringProperty(repeated=True, indexed=False)
+
+class SpeakerDirectoryChunk(ndb.Model):
+    """SpeakerDirectoryChunk -- sorted [displayName, mainEmail] of the
+    speakers in one name range of the directory; parent=SpeakerDirectory"""
+    speakers        = ndb.JsonProperty(compressed=True)
 
 class Session(ndb.Model):
     """Session -- Session object"""
@@ -106,8 +205,52 @@ class Session(ndb.Model):
     description     = ndb.TextProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    seatShards      = ndb.IntegerProperty(default=0, indexed=False)
+    # minutes since midnight, so time-of-day filters are integer range scans
+    startMinute     = ndb.ComputedProperty(lambda self:
+        self.time.hour * 60 + self.time.minute if self.time else None)
+    endMinute       = ndb.ComputedProperty(lambda self:
+        self.startMinute + self.duration
+        if self.startMinute is not None and self.duration is not None else None)
     
 
+class WishlistEntry(ndb.Model):
+    """WishlistEntry -- a session on a user's wishlist.  Child of the
+    Profile with the session websafeKey as id, so adds are idempotent and
+    listing one conference's entries is an ancestor query"""
+    session         = ndb.KeyProperty(kind='Session', required=True)
+    conference      = ndb.KeyProperty(kind='Conference', required=True)
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
+class SessionRegistration(ndb.Model):
+    """SessionRegistration -- a user's seat at a session.  Key id is
+    '<session websafeKey>:<user id>', no parent; shard is the SeatShard
+    the seat was taken from and goes back to"""
+    session         = ndb.KeyProperty(kind='Session', required=True)
+    userId          = ndb.StringProperty(required=True)
+    shard           = ndb.KeyProperty(kind='SeatShard', indexed=False)
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
+class NearlySoldOut(ndb.Model):
+    """NearlySoldOut -- the conferences named in the announcement; a
+    single entity (id 'nearlySoldOut') updated whenever a conference's
+    seatsAvailable crosses the threshold.  Until the seed query has been
+    merged in (seeded), touched lists the conferences whose crossing was
+    already recorded, which the seed must not override"""
+    conferences     = ndb.KeyProperty(kind='Conference', repeated=True)
+    seeded          = ndb.BooleanProperty(default=True, indexed=False)
+    touched         = ndb.KeyProperty(kind='Conference', repeated=True, indexed=False)
+    updated         = ndb.DateTimeProperty(auto_now=True)
+
+class ConferenceSchedule(ndb.Model):
+    """ConferenceSchedule -- compact copy of every session of a conference,
+    kept in one entity (id 1, parent=Conference) so that listing and
+    filtering a conference's sessions takes a single read; bookings maps
+    'speaker:<id>' and 'location:<room>' to their sorted [start, end,
+    websafeKey, latestEnd, latestKey] intervals"""
+    sessions        = ndb.JsonProperty(compressed=True)
+    bookings        = ndb.JsonProperty(compressed=True)
+
 class SessionForm(messages.Message):
     """SessionForm -- Session outbound form message"""
     speaker         = messages.StringField(1)
@@ -125,6 +268,38 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+class SessionResultForm(messages.Message):
+    """SessionResultForm -- outcome of creating one session; either the
+    created session or an error"""
+    session         = messages.MessageField(SessionForm, 1)
+    error           = messages.StringField(2)
+
+class SessionResultForms(messages.Message):
+    """SessionResultForms -- multiple SessionResultForm outbound form message"""
+    items = messages.MessageField(SessionResultForm, 1, repeated=True)
+
+class AgendaItemForm(messages.Message):
+    """AgendaItemForm -- a wishlisted session and the websafeKeys of the
+    other wishlisted sessions it overlaps"""
+    session = messages.MessageField(SessionForm, 1)
+    conflicts = messages.StringField(2, repeated=True)
+
+class AgendaForms(messages.Message):
+    """AgendaForms -- a user's agenda, sorted by start"""
+    items = messages.MessageField(AgendaItemForm, 1, repeated=True)
+
+class BookingConflictForm(messages.Message):
+    """BookingConflictForm -- two sessions booking the same speaker or
+    location at overlapping times"""
+    resource = messages.StringField(1)
+    value = messages.StringField(2)
+    sessions = messages.StringField(3, repeated=True)
+
+class BookingConflictForms(messages.Message):
+    """BookingConflictForms -- multiple BookingConflictForm outbound form message"""
+    items = messages.MessageField(BookingConflictForm, 1, repeated=True)
 
 class SessionType(messages.Enum):
     """type of session enumeration value"""
@@ -137,7 +312,8 @@ class Profile(ndb.Model):
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
+    conferenceKeysToAttend = UrlsafeKeyProperty(kind='Conference', repeated=True)
+    # legacy; moved into WishlistEntry children on the next wishlist call
     sessionKeysWishList = ndb.StringProperty(repeated=True)
 
 class ProfileMiniForm(messages.Message):
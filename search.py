@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""search.py
+
+Keyword search over conferences and sessions through an inverted index.
+
+Every (kind, token) pair has a posting list made of SearchPosting entities,
+one per document containing the token, found by an equality query on
+SearchPosting.term.  Documents are indexed when they are stored; a search
+reads only the posting lists of its own tokens and ranks the documents
+found in them.  Postings are read highest weight first, so the documents
+where a common token matters most are the ones kept.
+
+"""
+
+import math
+import re
+
+from google.appengine.ext import ndb
+
+from models import SearchPosting
+
+# postings read per search token, best first; also scales the rarity
+# boost below, which uses the full length of each posting list
+MAX_POSTINGS = 1000
+MIN_TOKEN_LENGTH = 2
+
+STOPWORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in',
+    'is', 'it', 'of', 'on', 'or', 'the', 'this', 'to', 'with',
+))
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    """Return the searchable tokens of text, in order, with repeats."""
+    return [token for token in _TOKEN_RE.findall((text or '').lower())
+            if len(token) >= MIN_TOKEN_LENGTH and token not in STOPWORDS]
+
+
+def termWeights(fields):
+    """Return {token: weight} for [(text, boost)] fields; a token's weight
+    is the sum of the boosts of the fields it occurs in, per occurrence."""
+    weights = {}
+    for text, boost in fields:
+        for token in tokenize(text):
+            weights[token] = weights.get(token, 0) + boost
+    return weights
+
+
+def _term(kind, token):
+    return '%s:%s' % (kind, token)
+
+
+def indexDocuments(docs):
+    """Store the postings of [(key, fields)] documents, where fields is
+    [(text, boost)]; re-indexing a document overwrites its postings."""
+    postings = []
+    for key, fields in docs:
+        wsk = key.urlsafe()
+        for token, weight in termWeights(fields).items():
+            term = _term(key.kind(), token)
+            postings.append(SearchPosting(id='%s|%s' % (term, wsk),
+                                          term=term, doc=key, weight=weight))
+    ndb.put_multi(postings)
+
+
+def search(kind, text):
+    """Return the keys of documents of kind matching any token of text,
+    best first: by number of query tokens matched, then by the summed
+    weights of those tokens, rarer tokens counting more."""
+    tokens = sorted(set(tokenize(text)))
+    queries = [SearchPosting.query(SearchPosting.term == _term(kind, token))
+               for token in tokens]
+    futures = [(query.order(-SearchPosting.weight).fetch_async(MAX_POSTINGS),
+                query.count_async()) for query in queries]
+    matched = {}
+    scores = {}
+    for postings_future, count_future in futures:
+        postings = postings_future.get_result()
+        if not postings:
+            continue
+        rarity = math.log(1.0 + float(MAX_POSTINGS) /
+                          max(count_future.get_result(), len(postings)))
+        for posting in postings:
+            matched[posting.doc] = matched.get(posting.doc, 0) + 1
+            scores[posting.doc] = scores.get(posting.doc, 0) + posting.weight * rarity
+    return sorted(matched, key=lambda key: (-matched[key], -scores[key],
+                                            key.urlsafe()))